@@ -1,48 +1,77 @@
+import csv
+import io
+import json
 import logging
-from typing import Any, Coroutine
-from datetime import datetime
+import zlib
+from typing import Any, Coroutine, Literal
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from typing import Optional
-from fastapi.concurrency import run_in_threadpool
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, File, Query, Request, UploadFile
+from fastapi.concurrency import iterate_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from fastapi import  status
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
-from app.api.deps import session_factory,admin_required,get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import get_async_db,admin_required,get_current_user
 from app.schemas.admin.admin import (GetCountResponse,
                                      CreateUserResponse,
                                      CreateUserRequest,
+                                     BulkCreateUsersRequest,
+                                     BulkCreateUsersResponse,
+                                     SkippedUser,
                                      UpdateUserRequest,
                                      UpdateUserResponse,
                                      DeleteUserRequest,
                                      UserWithReservedCodes,
                                      AddEkCodesRequest,
                                      AddEkCodeResponse,
+                                     AddEkCodesCsvResponse,
+                                     CODE_REGEX,
                                      LogsResponse,
                                      GetAllCountriesResponse,
-                                     LogSchema)
-from app.db.admin import crud
-from app.core.exceptions import (NoCodesAvailableError,
+                                     LogSchema,
+                                     UsageStatsResponse,
+                                     UsageStatsRow)
+from app.db.admin import async_crud as crud
+from app.db.admin.crud import (LOG_EXPORT_COLUMNS, USAGE_DIMENSIONS, USAGE_TIME_BUCKETS, USAGE_TZ,
+                                decode_codes_cursor, decode_log_cursor, usage_hour)
+from app.core.exceptions import (CodeBulkAddError,
+                                 NoCodesAvailableError,
                                  json_error,
                                  UserHasReservedCodesError,
+                                 ServiceOverloadedError,
                                  UserNotFound)
-from app.core.security import get_password_hash
+from app.core.security import token_cache
+from app.core.log_counts import log_count_cache
+from app.db.log_outbox import log_writer
+from app.core.hashing import password_hasher
+from app.core.admission import admission
+from app.core.maintenance import maintenance
+from app.core.principal import principal_cache
+from app.core.wait_queue import pool_waiters
+from app.config import settings
+from app.db.engine import AsyncSessionLocal, async_engine
 from app.db.models import CodeStatus, CodeType, CodeAction
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 MAX_PAGE_SIZE = 100
+MAX_CODES_PAGE_SIZE = 10000
+MAX_BULK_USERS = 1000
 DEFAULT_PAGE_SIZE = 20
 
 @router.get("/count")
 async def get_count(
-        _=Depends(admin_required)) -> GetCountResponse:
+        code_type: Optional[CodeType] = Query(None),
+        country: Optional[str] = Query(None),
+        _=Depends(admin_required),
+        db: AsyncSession = Depends(get_async_db)) -> GetCountResponse:
     try:
-        def work():
-            with session_factory() as db:
-                return crud.get_code_count(db=db)
-        count = await run_in_threadpool(work)
+        count = await crud.get_code_count(db=db, code_type=code_type, country=country)
         total = sum(count.values())
         return GetCountResponse(
             total = total,
@@ -51,73 +80,157 @@ async def get_count(
             non_usable = count.get("NON_USABLE", 0))
 
     except NoCodesAvailableError:
-        logger.exception()
         return json_error(404,"No codes in the database","Please provide some ek codes")
 
 @router.post("/users/create")
 async def create_user(
                 _=Depends(admin_required),
-                req : CreateUserRequest = Depends()):
+                req : CreateUserRequest = Depends(),
+                db: AsyncSession = Depends(get_async_db)):
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                    result = crud.create_user(
-                    db,
-                    req.team_name,
-                    req.user_name,
-                    req.contact_email,
-                    hashed_password,
-                    req.is_admin
-                    )
-                    db.commit()
-                    return result
-                except Exception as e:
-                    db.rollback()
-                    raise e
-        hashed_password = await run_in_threadpool(get_password_hash,req.password)
-        user= await run_in_threadpool(work)
+        # Hand back any connection the auth lookup took while bcrypt runs
+        await db.rollback()
+        hashed_password = await password_hasher.hash(req.password)
+        user = await crud.create_user(
+            db,
+            req.team_name,
+            req.user_name,
+            req.contact_email,
+            hashed_password,
+            req.is_admin
+        )
+        await db.commit()
         return user
+    except ServiceOverloadedError:
+        raise
     except:
         return json_error(500,f"{status.HTTP_500_INTERNAL_SERVER_ERROR}","Something went wrong")
 
 
+async def _provision_users(
+        db: AsyncSession,
+        users: list[CreateUserRequest],
+        skipped: list[SkippedUser],
+        requested: int) -> BulkCreateUsersResponse:
+    """Drop duplicates and known emails, hash the rest in parallel, insert them in one statement."""
+    unique: dict[str, CreateUserRequest] = {}
+    for u in users:
+        if u.contact_email in unique:
+            skipped.append(SkippedUser(contact_email=u.contact_email, reason="duplicate_in_request"))
+        else:
+            unique[u.contact_email] = u
+
+    for email in await crud.existing_user_emails(db, unique.keys()):
+        del unique[email]
+        skipped.append(SkippedUser(contact_email=email, reason="already_exists"))
+    # Don't hold a pooled connection through the hashing rounds
+    await db.rollback()
+
+    pending = list(unique.values())
+    hashes = await password_hasher.hash_many([u.password for u in pending])
+
+    rows = await crud.bulk_create_users(db, [
+        {
+            "team_name": u.team_name,
+            "user_name": u.user_name,
+            "contact_email": u.contact_email,
+            "password_hash": h,
+            "is_admin": u.is_admin,
+        }
+        for u, h in zip(pending, hashes)
+    ]) if pending else []
+    await db.commit()
+
+    created = {r.contact_email for r in rows}
+    skipped += [SkippedUser(contact_email=u.contact_email, reason="already_exists")
+                for u in pending if u.contact_email not in created]
+    return BulkCreateUsersResponse(
+        requested=requested,
+        created=[CreateUserResponse.model_validate(r) for r in rows],
+        skipped=skipped,
+    )
+
+
+@router.post("/users/bulk", response_model=BulkCreateUsersResponse)
+async def bulk_create_users(
+        req: BulkCreateUsersRequest,
+        _=Depends(admin_required),
+        db: AsyncSession = Depends(get_async_db)):
+    try:
+        return await _provision_users(db, req.users, [], len(req.users))
+    except ServiceOverloadedError:
+        raise
+    except Exception:
+        logger.exception("bulk_create_users_failed")
+        return json_error(500, f"{status.HTTP_500_INTERNAL_SERVER_ERROR}", "Something went wrong")
+
+
+@router.post("/users/bulk/csv", response_model=BulkCreateUsersResponse)
+async def bulk_create_users_csv(
+        file: UploadFile = File(..., description="CSV with team_name,user_name,contact_email,password[,is_admin]"),
+        _=Depends(admin_required),
+        db: AsyncSession = Depends(get_async_db)):
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+        rows = list(csv.DictReader(io.StringIO(text)))
+    except UnicodeDecodeError:
+        return json_error(400, "invalid_csv", "CSV must be UTF-8 encoded")
+    except csv.Error as e:
+        return json_error(400, "invalid_csv", f"Malformed CSV: {e}")
+
+    users: list[CreateUserRequest] = []
+    skipped: list[SkippedUser] = []
+    if len(rows) > MAX_BULK_USERS:
+        return json_error(400, "too_many_rows", f"At most {MAX_BULK_USERS} users per upload")
+    for line, row in enumerate(rows, start=2):
+        try:
+            row["is_admin"] = (row.get("is_admin") or "").strip().lower() in ("1", "true", "yes")
+            users.append(CreateUserRequest(**row))
+        except (ValidationError, AttributeError, KeyError, TypeError) as e:
+            skipped.append(SkippedUser(
+                contact_email=(row.get("contact_email") or "").strip() or None,
+                reason="invalid_row",
+                detail=f"line {line}: {e}",
+            ))
+    try:
+        return await _provision_users(db, users, skipped, len(rows))
+    except ServiceOverloadedError:
+        raise
+    except Exception:
+        logger.exception("bulk_create_users_csv_failed")
+        return json_error(500, f"{status.HTTP_500_INTERNAL_SERVER_ERROR}", "Something went wrong")
+
+
 @router.get("/users/get-users", response_model=list[UserWithReservedCodes])
 async def get_users_with_code(
                 _= Depends(admin_required),
-                admin = Depends(get_current_user)):
+                admin = Depends(get_current_user),
+                db: AsyncSession = Depends(get_async_db)):
     try:
-        def work():
-            with session_factory() as db:
-                users = crud.fetch_users_with_reserved_codes(db = db,only_user_id=admin.id)
-                if not users:
-                    raise UserNotFound("No users found in the database")
-                result: list[dict[str, Any]] = []
-                for u in users:
-                    reserved_codes = []
-                    for c in u.codes:
-                        if getattr(c, "status", None) == CodeStatus.RESERVED:
-                            reserved_codes.append({
-                                "code": c.code,
-                                "code_type": c.code_type.value if hasattr(c.code_type, "value") else c.code_type,
-                                "countries": [co.name for co in c.countries],  # list[str]
-                            })
-
-                    result.append({
-                        "id": u.id,
-                        "user_name": u.user_name,
-                        "team_name": u.team_name,
-                        "contact_email": u.contact_email,
-                        "is_admin": u.is_admin,
-                        "reserved_count": len(reserved_codes),
-                        "reserved_codes": reserved_codes,
+        users = await crud.fetch_users_with_reserved_codes(db = db,only_user_id=admin.id)
+        if not users:
+            raise UserNotFound("No users found in the database")
+        result: list[dict[str, Any]] = []
+        for u in users:
+            reserved_codes = []
+            for c in u.codes:
+                if getattr(c, "status", None) == CodeStatus.RESERVED:
+                    reserved_codes.append({
+                        "code": c.code,
+                        "code_type": c.code_type.value if hasattr(c.code_type, "value") else c.code_type,
+                        "countries": [co.name for co in c.countries],  # list[str]
                     })
 
-                return result
-
-
+            result.append({
+                "id": u.id,
+                "user_name": u.user_name,
+                "team_name": u.team_name,
+                "contact_email": u.contact_email,
+                "is_admin": u.is_admin,
+                "reserved_count": len(reserved_codes),
+                "reserved_codes": reserved_codes,
+            })
 
-        result = await run_in_threadpool(work)
         return result
     except UserNotFound as e:
         return json_error(404, f"{status.HTTP_404_NOT_FOUND}", e.message)
@@ -126,52 +239,30 @@ async def get_users_with_code(
 @router.patch("/users/update", response_model=UpdateUserResponse)
 async def update_user(
         _= Depends(admin_required),
-        req: UpdateUserRequest = Depends()
+        req: UpdateUserRequest = Depends(),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    # try:
-        def work():
-            with session_factory() as db:
-                try:
-                    print(req)
-                    user = crud.update_user(db=db,
-                                            id=req.id,
-                                            team_name=req.team_name,
-                                            user_name=req.user_name,
-                                            contact_email=req.contact_email,
-                                            password=req.password,
-                                            is_admin=req.is_admin)
-                    db.commit()
-                    db.refresh(user)
-                    return user
-                except Exception as e:
-                    db.rollback()
-                    raise e
-        updated_user = await run_in_threadpool(work)
-        return updated_user
-    # except UserNotFound as e:
-    #     logger.exception()
-    #     return json_error(404, f"{status.HTTP_404_NOT_FOUND}","User not found")
-    # except Exception as e:
-    #     logger.exception()
-    #     return {"error": "Failed to update user"}
+    user = await crud.update_user(db=db,
+                                  id=req.id,
+                                  team_name=req.team_name,
+                                  user_name=req.user_name,
+                                  contact_email=req.contact_email,
+                                  password=req.password,
+                                  is_admin=req.is_admin)
+    await db.commit()
+    await db.refresh(user)
+    return user
 
 
 @router.delete("/users/delete")
 async def delete_user(
         _=Depends(admin_required),
-        req: DeleteUserRequest =Depends()
+        req: DeleteUserRequest =Depends(),
+        db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                    crud.delete_user(db = db,user_id = req.id)
-                    db.commit()
-                except Exception as e:
-                    db.rollback()
-                    raise e
-
-        await run_in_threadpool(work)
+        await crud.delete_user(db = db,user_id = req.id)
+        await db.commit()
         return   {"message": "User deleted successfully"}
     except UserNotFound:
         return json_error(404,"User not found","Unable to locate the user in the database")
@@ -185,27 +276,19 @@ async def delete_user(
 async def add_ek_code(
     req: AddEkCodesRequest = Depends(),
     _: bool = Depends(admin_required),
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 )-> dict | Any:
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                    result = crud.bulk_add_codes(
-                        db=db,
-                        code_type=req.code_type,
-                        countries =req.countries,
-                        codes=req.codes,
-                        contact_email = current_user.contact_email,
-                        user_name = current_user.user_name,
-                    )
-                    db.commit()
-                    return result
-                except Exception as e:
-                    db.rollback()
-                    raise e
-
-        result = await run_in_threadpool(work)
+        result = await crud.bulk_add_codes(
+            db=db,
+            code_type=req.code_type,
+            countries =req.countries,
+            codes=req.codes,
+            contact_email = current_user.contact_email,
+            user_name = current_user.user_name,
+        )
+        await db.commit()
         return result
 
     except ValueError as ve:
@@ -219,52 +302,188 @@ async def add_ek_code(
         return json_error(500, "unexpected_error", "Unexpected server error.")
 
 
-@router.get("/codes/all")
-async def get_all_codes(_=Depends(admin_required)):
+def _csv_code_chunks(file: UploadFile):
+    """
+    First-column codes from an uploaded CSV in CODE_INGEST_CHUNK batches,
+    read as the chunks are consumed; a leading "code" header is skipped.
+    Reads block on the spooled upload, so iterate it in the threadpool.
+    """
+    chunk: list[str] = []
+    for line, row in enumerate(csv.reader(io.TextIOWrapper(file.file, encoding="utf-8-sig"))):
+        raw = row[0] if row else ""
+        if line == 0 and raw.strip().lower() == "code":
+            continue
+        chunk.append(raw)
+        if len(chunk) >= settings.CODE_INGEST_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@router.post("/codes/add/csv", response_model=AddEkCodesCsvResponse)
+async def add_ek_codes_csv(
+    file: UploadFile = File(..., description="CSV with one code per row in the first column"),
+    code_type: Literal["OSV", "HSV", "COMMON"] = Query(..., description="OSV | HSV | COMMON"),
+    countries: list[str] = Query([]),
+    _: bool = Depends(admin_required),
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if code_type != "COMMON" and not countries:
+        raise CodeBulkAddError("countries is required unless code_type is 'COMMON'")
     try:
+        result = await crud.ingest_codes(
+            db=db,
+            code_type=code_type,
+            countries=countries,
+            chunks=iterate_in_threadpool(_csv_code_chunks(file)),
+            contact_email=current_user.contact_email,
+            user_name=current_user.user_name,
+            code_pattern=CODE_REGEX,
+        )
+        await db.commit()
+        return result
 
-        def work():
-            with session_factory() as db:
-                return crud.get_codes_grouped(db)
-
-        rows = await run_in_threadpool(work)
-        result = {
-            CodeType.OSV.value: {"reserved": [], "can_be_used": []},
-            CodeType.HSV.value: {"reserved": [], "can_be_used": []},
-            CodeType.COMMON.value: {"reserved": [], "can_be_used": []},
-        }
+    except UnicodeDecodeError:
+        return json_error(400, "invalid_csv", "CSV must be UTF-8 encoded")
+    except csv.Error as e:
+        return json_error(400, "invalid_csv", f"Malformed CSV: {e}")
+    except ValueError as ve:
+        return json_error(400, "invalid_input", str(ve))
+    except IntegrityError:
+        return json_error(409, "conflict", "One or more codes conflict with existing data.")
+    except SQLAlchemyError:
+        return json_error(500, "db_error", "Database error while adding codes.")
+    except Exception:
+        logger.exception("bulk_add_csv_unexpected_error")
+        return json_error(500, "unexpected_error", "Unexpected server error.")
 
-        for c in rows:
-            if c.status.value == CodeStatus.RESERVED.value:
-                result[c.code_type]["reserved"].append(c.code)
-            elif c.status.value == CodeStatus.CAN_BE_USED.value:
-                result[c.code_type]["can_be_used"].append(c.code)
 
-        return result
+_CODE_LIST_KEYS = {CodeStatus.RESERVED: "reserved", CodeStatus.CAN_BE_USED: "can_be_used"}
+
+
+class _GroupedCodesWriter:
+    """
+    Writes {"<code_type>": {"reserved": [...], "can_be_used": [...]}, ...}
+    piece by piece from rows sorted by (code_type, status), emitting empty
+    lists for the types and statuses that have no rows.
+    """
+
+    def __init__(self, code_types: list[CodeType], statuses: list[CodeStatus]):
+        self.code_types = code_types
+        self.statuses = statuses
+        self.code_type: CodeType | None = None
+        self.status: CodeStatus | None = None
+        self.done_types: list[CodeType] = []
+        self.done_statuses: list[CodeStatus] = []
+        self.first_code = True
+
+    def start(self) -> str:
+        return "{"
+
+    def feed(self, rows) -> str:
+        out = []
+        for code_type, status, code in rows:
+            if code_type != self.code_type:
+                out.append(self._close_type())
+                out.append(f'{"," if self.done_types else ""}{json.dumps(code_type.value)}:{{')
+                self.code_type, self.status, self.done_statuses = code_type, None, []
+            if status != self.status:
+                if self.status is not None:
+                    out.append("],")
+                    self.done_statuses.append(self.status)
+                out.append(f'{json.dumps(_CODE_LIST_KEYS[status])}:[')
+                self.status, self.first_code = status, True
+            out.append(json.dumps(code) if self.first_code else "," + json.dumps(code))
+            self.first_code = False
+        return "".join(out)
+
+    def finish(self) -> str:
+        out = [self._close_type()]
+        for code_type in self.code_types:
+            if code_type not in self.done_types:
+                out.append(f'{"," if self.done_types else ""}{json.dumps(code_type.value)}:{{')
+                out.append(",".join(f'{json.dumps(_CODE_LIST_KEYS[s])}:[]' for s in self.statuses) + "}")
+                self.done_types.append(code_type)
+        out.append("}")
+        return "".join(out)
+
+    def _close_type(self) -> str:
+        if self.code_type is None:
+            return ""
+        out = []
+        if self.status is not None:
+            out.append("]")
+            self.done_statuses.append(self.status)
+        missing = [s for s in self.statuses if s not in self.done_statuses]
+        out.extend(f'{"," if i or self.done_statuses else ""}{json.dumps(_CODE_LIST_KEYS[s])}:[]'
+                   for i, s in enumerate(missing))
+        out.append("}")
+        self.done_types.append(self.code_type)
+        self.code_type = self.status = None
+        return "".join(out)
+
+
+async def _grouped_codes_body(writer: _GroupedCodesWriter, filters: dict, until: Optional[str]):
+    yield writer.start()
+    try:
+        # The request's session is closed before the body streams, so the listing holds its own
+        async with AsyncSessionLocal() as db:
+            async for rows in crud.get_codes_grouped(db, until=until, **filters):
+                yield writer.feed(rows)
     except Exception:
-        logger.exception("delete_code_unexpected_error")
-        return json_error(500, "unexpected_error", "Unexpected server error.")
+        logger.exception("get_all_codes_failed")
+        raise
+    yield writer.finish()
+
+
+@router.get("/codes/all")
+async def get_all_codes(
+    _=Depends(admin_required),
+    code_type: Optional[CodeType] = Query(None, description="Only this code type"),
+    status: Optional[Literal["reserved", "can_be_used"]] = Query(None, description="Only this status"),
+    country: Optional[str] = Query(None, description="Only codes valid in this country"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_CODES_PAGE_SIZE, description="Page size; all codes when omitted"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Reserved and free codes grouped by type and status, streamed as the rows
+    come off a server-side cursor. With limit, the X-Next-Cursor response
+    header carries the cursor of the following page, if any.
+    """
+    if cursor:
+        try:
+            decode_codes_cursor(cursor)
+        except ValueError:
+            return json_error(status_code=400, code="Invalid input", message="Invalid cursor.")
+
+    status_filter = next((s for s, key in _CODE_LIST_KEYS.items() if key == status), None)
+    filters = {"code_type": code_type, "status": status_filter,
+               "country": country.strip() if country else None, "cursor": cursor}
+    # The page is streamed from another snapshot, so it is bounded by the next cursor rather than by limit
+    next_cursor = await crud.codes_next_cursor(db, limit, **filters) if limit else None
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+    writer = _GroupedCodesWriter([code_type] if code_type else list(CodeType),
+                                 [status_filter] if status_filter else list(_CODE_LIST_KEYS))
+    return StreamingResponse(_grouped_codes_body(writer, filters, next_cursor), media_type="application/json",
+                             headers=headers)
 
 
 @router.delete("/codes/{code}")
 async def delete_code(
     code: str,
     _=Depends(admin_required),
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        def work():
-            try:
-                with session_factory() as db:
-                    crud.delete_code(db,code=code,
-                                     user_name=current_user.user_name,
-                                     contact_email=current_user.contact_email)
-
-                    db.commit()
-            except Exception as e:
-                db.rollback()
-                raise e
-        await run_in_threadpool(work)
+        await crud.delete_code(db,code=code,
+                         user_name=current_user.user_name,
+                         contact_email=current_user.contact_email)
+        await db.commit()
         return {"message": f"Deleted {code}"}
     except NoCodesAvailableError:
         return json_error(404, "not_found", "Code does not exist or is reserved.")
@@ -273,67 +492,228 @@ async def delete_code(
         return json_error(500, "unexpected_error", "Unexpected server error.")
 
 
+def _parse_log_dates(start_date: Optional[str], end_date: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
+    """The /logs date filters; raises ValueError with the message to return."""
+    try:
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        end_dt = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        raise ValueError("Invalid date format. Use ISO format YYYY-MM-DD.")
+    if start_dt and end_dt and start_dt > end_dt:
+        raise ValueError("start_date cannot be after end_date.")
+    return start_dt, end_dt
+
+
 @router.get("/logs", response_model=LogsResponse)
 async def get_logs(
     _=Depends(admin_required),
-    page: int = Query(1, ge=1, description="Page number starting from 1"),
+    page: int = Query(1, ge=1, description="Page number starting from 1 (ignored with cursor)", deprecated=True),
     page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="next_cursor or prev_cursor from a previous page"),
+    count: Optional[Literal["exact", "estimated", "cached"]] = Query(None, description="How to compute total_count (default from LOG_COUNT_MODE)"),
     code: Optional[str] = Query(None, description="Filter by code"),
     user_name: Optional[str] = Query(None, description="Filter by user name"),
     action: Optional[CodeAction] = Query(None, description="Filter by code action"),
     start_date: Optional[str] = Query(None, description="Start date in ISO format (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="End date in ISO format (YYYY-MM-DD)"),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        start_dt = datetime.fromisoformat(start_date) if start_date else None
-        end_dt = datetime.fromisoformat(end_date) if end_date else None
-    except ValueError:
-        return json_error(status_code=400, code="Invalid input", message="Invalid date format. Use ISO format YYYY-MM-DD.")
+        start_dt, end_dt = _parse_log_dates(start_date, end_date)
+    except ValueError as e:
+        return json_error(status_code=400, code="Invalid input", message=str(e))
 
-    if start_dt and end_dt and start_dt > end_dt:
-        return json_error(status_code=400, code="Invalid input", message="start_date cannot be after end_date.")
+    if cursor:
+        try:
+            decode_log_cursor(cursor)
+        except ValueError:
+            return json_error(status_code=400, code="Invalid input", message="Invalid cursor.")
 
-    offset = (page - 1) * page_size
+    offset = 0 if cursor else (page - 1) * page_size
     if code:
         code=code.strip()
     if user_name:
         user_name=user_name.strip()
 
-    def work():
-        with session_factory() as db:
-            return crud.get_logs_filtered(
-                db=db,
-                code=code,
-                user_name=user_name,
-                start_date=start_dt,
-                end_date=end_dt,
-                action=action,
-                offset=offset,
-                limit=page_size,
-            )
-
     try:
-        total_count, logs = await run_in_threadpool(work)
+        page = await crud.get_logs_filtered(
+            db=db,
+            code=code,
+            user_name=user_name,
+            start_date=start_dt,
+            end_date=end_dt,
+            action=action,
+            offset=offset,
+            limit=page_size,
+            cursor=cursor or None,
+            count_mode=count,
+        )
 
         # Convert Log ORM objects to Pydantic schema objects
-        logs_response = [LogSchema.from_orm(log) for log in logs]
+        logs_response = [LogSchema.from_orm(log) for log in page.logs]
 
-        return LogsResponse(total_count=total_count, logs=logs_response)
+        return LogsResponse(total_count=page.total_count, logs=logs_response,
+                            next_cursor=page.next_cursor, prev_cursor=page.prev_cursor,
+                            count_mode=page.count_mode)
 
     except Exception:
         logger.exception("get_logs_unexpected_error")
         return json_error(500, "unexpected_error", "Unexpected server error.")
 
 
-@router.get("/countries",response_model=list[GetAllCountriesResponse])
-async def get_all_countries(_=Depends(admin_required),):
+def _export_record(row) -> dict:
+    record = row._asdict()
+    record["action"] = record["action"].value
+    record["logged_at"] = record["logged_at"].isoformat()
+    return record
+
+
+def _csv_chunk(rows) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(_export_record(row).values())
+    return buf.getvalue()
+
+
+def _ndjson_chunk(rows) -> str:
+    return "".join(json.dumps(_export_record(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+async def _log_export_body(fmt: str, compress: bool, filters: dict):
+    gz = zlib.compressobj(settings.LOG_EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return gz.compress(data) if gz else data
+
+    if fmt == "csv":
+        yield encode(",".join(LOG_EXPORT_COLUMNS) + "\r\n")
+    try:
+        # The request's session is closed before the body streams, so the export holds its own
+        async with AsyncSessionLocal() as db:
+            async for rows in crud.export_logs(db, **filters):
+                data = encode(_csv_chunk(rows) if fmt == "csv" else _ndjson_chunk(rows))
+                if data:
+                    yield data
+    except Exception:
+        # Headers are already out; aborting the response is the only way left to tell the client
+        logger.exception("export_logs_failed")
+        raise
+    if gz:
+        yield gz.flush()
+
+
+@router.get("/logs/export")
+async def export_logs(
+    request: Request,
+    _=Depends(admin_required),
+    format: Literal["csv", "ndjson"] = Query("csv", description="csv with a header row, or ndjson"),
+    code: Optional[str] = Query(None, description="Filter by code"),
+    user_name: Optional[str] = Query(None, description="Filter by user name"),
+    action: Optional[CodeAction] = Query(None, description="Filter by code action"),
+    start_date: Optional[str] = Query(None, description="Start date in ISO format (YYYY-MM-DD)"),
+    end_date: Optional[str] = Query(None, description="End date in ISO format (YYYY-MM-DD)"),
+):
+    """
+    Every log matching the /logs filters, newest first, streamed from a
+    server-side cursor in constant memory. Gzip-compressed on the fly when
+    the client sends Accept-Encoding: gzip.
+    """
     try:
-        def work():
-            with session_factory() as db:
-                return crud.get_all_countries(db)
+        start_dt, end_dt = _parse_log_dates(start_date, end_date)
+    except ValueError as e:
+        return json_error(status_code=400, code="Invalid input", message=str(e))
+
+    filters = {
+        "start_date": start_dt,
+        "end_date": end_dt,
+        "code": code.strip() if code else None,
+        "user_name": user_name.strip() if user_name else None,
+        "action": action,
+    }
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"Content-Disposition": f'attachment; filename="logs.{format}"'}
+    if compress:
+        # Set here, GZipMiddleware leaves the body alone
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(_log_export_body(format, compress, filters), media_type=media_type, headers=headers)
+
+
+@router.get("/stats", response_model=UsageStatsResponse, response_model_exclude_unset=True)
+async def get_usage_stats(
+    _=Depends(admin_required),
+    start: Optional[datetime] = Query(None, description="Range start, ISO date or datetime (default: 7 days ago)"),
+    end: Optional[datetime] = Query(None, description="Range end, exclusive (default: now)"),
+    group_by: str = Query("", description="Comma-separated: one of hour/day/week/month plus any of "
+                                          "action, region, country, code_type, team"),
+    action: Optional[CodeAction] = Query(None),
+    region: Optional[str] = Query(None),
+    country: Optional[str] = Query(None),
+    code_type: Optional[CodeType] = Query(None),
+    team: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Log counts from the hourly usage rollups, e.g. RESERVED codes per day
+    for region=Europe&code_type=OSV. Times without an offset are IST.
+    """
+    tz = ZoneInfo(USAGE_TZ)
+    end = end or datetime.now(tz)
+    start = start or end - timedelta(days=7)
+    start, end = (dt if dt.tzinfo else dt.replace(tzinfo=tz) for dt in (start, end))
+    if start >= end:
+        return json_error(status_code=400, code="Invalid input", message="start must be before end.")
+    if usage_hour(start) >= usage_hour(end):
+        return json_error(status_code=400, code="Invalid input",
+                          message="Stats are counted per hour; start and end must not fall in the same hour.")
+
+    groups = [g.strip() for g in group_by.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in USAGE_TIME_BUCKETS and g not in USAGE_DIMENSIONS]
+    if unknown or len(set(groups)) < len(groups) or sum(g in USAGE_TIME_BUCKETS for g in groups) > 1:
+        return json_error(status_code=400, code="Invalid input",
+                          message=f"group_by takes at most one of {', '.join(USAGE_TIME_BUCKETS)} "
+                                  f"and any of {', '.join(USAGE_DIMENSIONS)}.")
+
+    filters = {name: value.value if isinstance(value, CodeAction | CodeType) else value.strip()
+               for name, value in (("action", action), ("region", region), ("country", country),
+                                   ("code_type", code_type), ("team", team)) if value}
+
+    watermark, rows = await crud.get_usage_stats(db, start, end, groups, filters)
+    return UsageStatsResponse(
+        start=start,
+        end=end,
+        group_by=groups,
+        rolled_up_to=watermark,
+        rows=[
+            UsageStatsRow(**{k: (None if v == "" else getattr(v, "value", v)) for k, v in row._mapping.items()})
+            for row in rows
+        ],
+    )
 
-        result = await run_in_threadpool(work)
-        return [{"id": row.id, "country": row.name} for row in result]
 
-    except Exception as e:
-        raise e
\ No newline at end of file
+@router.get("/countries",response_model=list[GetAllCountriesResponse])
+async def get_all_countries(_=Depends(admin_required), db: AsyncSession = Depends(get_async_db)):
+    result = await crud.get_all_countries(db)
+    return [{"id": row.id, "country": row.name} for row in result]
+
+
+@router.get("/metrics")
+async def get_metrics(_=Depends(admin_required)):
+    """Background job timings and counters for this worker."""
+    return {
+        "maintenance": maintenance.stats(),
+        "reserve_waiters": pool_waiters.depth(),
+        "principal_cache": principal_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "log_count_cache": log_count_cache.stats(),
+        "log_writer": log_writer.stats(),
+        "password_hasher": password_hasher.stats(),
+        "admission": admission.stats(),
+        "db_pool": {
+            "size": async_engine.pool.size(),
+            "checked_out": async_engine.pool.checkedout(),
+            "overflow": async_engine.pool.overflow(),
+        },
+    }
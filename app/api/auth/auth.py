@@ -1,21 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from app.schemas.auth import Token, UserOut
-from app.api.deps import get_db, get_current_user, oauth2_scheme
-from app.core.security import verify_password, create_access_token
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import get_async_db, get_current_user, oauth2_scheme
+from app.core.principal import Principal
+from app.core.security import create_access_token
+from app.core.hashing import password_hasher
 from app.db.models import User
-from sqlalchemy.orm import Session
 from app.config import settings
 from fastapi.security import OAuth2PasswordRequestForm
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     email = form_data.username.strip().lower()
     password = form_data.password.strip()
-    user = db.query(User).filter(User.contact_email == email).first()
 
-    if not user or not verify_password(password, user.password_hash):
+    user = (await db.execute(select(User).where(User.contact_email == email))).scalars().first()
+    # Nothing left to read; give the connection back before bcrypt runs
+    await db.close()
+
+    if not user or not await password_hasher.verify(password, user.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect credentials")
 
     # Derive code_type from team_name or user object
@@ -34,7 +40,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return Token(access_token=token, expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
 @router.get("/me", response_model=UserOut)
-def me(current_user: User = Depends(get_current_user)):
+async def me(current_user: Principal = Depends(get_current_user)):
     return UserOut(id=current_user.id, team_name=current_user.team_name, contact_email=current_user.contact_email, is_admin=current_user.is_admin)
 
 @router.post("/logout")
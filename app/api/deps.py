@@ -2,11 +2,11 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError
 from app.core.security import decode_token
-from app.db.engine import SessionLocal
+from app.core.principal import Principal, principal_cache
+from app.db.engine import AsyncSessionLocal
 from app.db.models import User
-from sqlalchemy.orm import Session
-from typing import Generator, Any
-from contextlib import contextmanager
+from typing import AsyncGenerator, Any
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.exceptions import PermissionDeniedError,UsersOnlyError
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -17,52 +17,46 @@ credentials_exception = HTTPException(
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-def get_db() -> Generator:
-    db = SessionLocal()
-    try:
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Request-scoped unit of work. FastAPI caches dependencies per request, so
+    authentication and the handler share this one session and a request holds
+    at most one pooled connection. Handlers commit once with db.commit();
+    whatever is still open when the request ends is rolled back. The session
+    only checks a connection out on its first query and hands it back as soon
+    as the transaction ends, so a principal cache hit never touches the pool.
+    """
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def get_tx_db() -> Generator:
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except:
-        db.rollback()
-        raise
-    finally:
-        db.close()
-
-@contextmanager
-def session_factory() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
     try:
         payload = decode_token(token)
         sub = payload.get("sub")
         if sub is None:
             raise credentials_exception
-    except JWTError:
+        user_id = int(sub)
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    user = db.get(User, int(sub))
-    if user is None:
-        raise credentials_exception
-    return user
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = await db.get(User, user_id)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        principal_cache.put(principal)
+    return principal
 
-def admin_required(current_user: User = Depends(get_current_user)):
+async def admin_required(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_admin:
         raise PermissionDeniedError()
     return current_user
 
-def user_required(current_user: User = Depends(get_current_user)) -> User:
+async def user_required(current_user: Principal = Depends(get_current_user)) -> Principal:
     if current_user.is_admin:
         raise UsersOnlyError()
     return current_user
\ No newline at end of file
@@ -1,19 +1,29 @@
+import asyncio
 import logging
-from fastapi.concurrency import run_in_threadpool
-from fastapi import APIRouter, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, Header
 from app.schemas.users.users import (ReserveRequest,
                                      ReserveResponse,
+                                     BatchReserveRequest,
+                                     BatchReserveResponse,
                                      BatchCodes,
+                                     BatchReleaseRequest,
+                                     BatchReleaseResponse,
                                      LogsResponse,
                                      LogSchema,
                                      MarkNonUsableRequest,
                                      MarkNonUsableResponse,
                                      GetAllCountriesResponse, CodeCommentPayload)
-from app.db.users import crud
-from app.db.models import User
-from app.api.deps import  user_required, session_factory
+from app.db.users import async_crud as crud
+from app.core.principal import Principal
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.deps import  user_required, get_async_db
+from app.core.wait_queue import pool_waiters
+from app.core.admission import admission
+from app.core import idempotency
 from app.core.exceptions import (
     NoCodesAvailableError,
+    IdempotencyKeyReusedError,
     json_error,
 )
 
@@ -22,29 +32,66 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/users", tags=["users"])
 
 
+async def _reserve_or_wait(db: AsyncSession, work, code_type, country, wait_seconds):
+    """
+    Await work() and, while it finds the pool empty, park until codes are
+    returned (or wait_seconds run out) and try again. The failed attempt is
+    rolled back first and the admission slot given up, so a parked request
+    holds neither a pooled connection nor a share of the concurrency limit.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (wait_seconds or 0)
+    ticket = None
+    while True:
+        try:
+            return await work()
+        except NoCodesAvailableError:
+            await db.rollback()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise
+            async with admission.suspended():
+                ticket = await pool_waiters.wait(code_type, country, remaining, ticket)
+
+
+def idempotency_key_header(
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=128),
+) -> Optional[str]:
+    return idempotency_key
+
+
 @router.post("/reserve", response_model=ReserveResponse)
 async def reserve(
     req: ReserveRequest,
     current_user = Depends(user_required),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                     code = crud.reserve_one_code(
-                        db=db,
-                        user=current_user,
-                        tester_name=req.tester_name,
-                        country =req.country,
-                        code_type=req.code_type)
-                     db.commit()
-                     return code
-                except Exception as e:
-                    db.rollback()
-                    raise e
-
-        code = await run_in_threadpool(work)
-        return ReserveResponse(code=code.code, code_type=code.code_type, reservation_token=code.reservation_token)  # or custom dict output
+        replay = idempotency.lookup(current_user.id, idempotency_key, "reserve")
+        if replay:
+            return replay.to_response()
+
+        async def reserve_code(db):
+            code = await crud.reserve_one_code(
+                db=db,
+                user=current_user,
+                tester_name=req.tester_name,
+                country =req.country,
+                code_type=req.code_type)
+            return ReserveResponse(code=code.code, code_type=code.code_type, reservation_token=code.reservation_token, region=code.region_name)
+
+        async def work():
+            result = await idempotency.run_idempotent_async(db, current_user.id, idempotency_key, "reserve", reserve_code)
+            await db.commit()
+            return result
+
+        result = await _reserve_or_wait(db, work, req.code_type, req.country, req.wait_seconds)
+        idempotency.remember(current_user.id, idempotency_key, result)
+        return result.to_response()
+
+    except IdempotencyKeyReusedError as e:
+        return json_error(409, "idempotency_key_reused", e.message)
 
     except NoCodesAvailableError:
         return json_error(404, "no_codes_available", "No codes available right now.")
@@ -55,32 +102,57 @@ async def reserve(
 
 
 
+@router.post("/reserve/batch", response_model=BatchReserveResponse)
+async def reserve_batch(
+    req: BatchReserveRequest,
+    current_user = Depends(user_required),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        async def work():
+            codes = await crud.reserve_codes(
+                db=db,
+                user=current_user,
+                tester_name=req.tester_name,
+                country=req.country,
+                code_type=req.code_type,
+                count=req.count)
+            await db.commit()
+            return codes
+
+        codes = await _reserve_or_wait(db, work, req.code_type, req.country, req.wait_seconds)
+        return BatchReserveResponse(
+            requested=req.count,
+            reserved=len(codes),
+            partial=len(codes) < req.count,
+            codes=[ReserveResponse(code=c.code, code_type=c.code_type, reservation_token=c.reservation_token, region=c.region_name) for c in codes],
+        )
+
+    except NoCodesAvailableError:
+        return json_error(404, "no_codes_available", "No codes available right now.")
+
+    except Exception:
+        logger.exception("reserve_batch_failed")
+        return json_error(500, "reserve_failed", "Server error while reserving codes.")
+
+
 @router.get("/my", summary="List my reserved codes")
-async def list_my_codes( current_user = Depends(user_required)):
+async def list_my_codes( current_user = Depends(user_required), db: AsyncSession = Depends(get_async_db)):
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                     codes = crud.list_of_codes(db=db, user = current_user)
-                     result = []
-                     for code in codes:
-                         result.append({
-                             "code": code.code,
-                             "tester_name": code.tester_name,
-                             "requested_at": code.requested_at,
-                             "reservation_token": code.reservation_token,
-                             "status": code.status.value,
-                             "note": code.note,
-                             "countries": [c.name for c in code.countries],
-                             "regions": list({c.region.name for c in code.countries if c.region}),  # dedupe regions
-                         })
-                     return result
-
-                except Exception as e:
-                    raise e
-
-        rows= await run_in_threadpool(work)
-        return [dict(r) for r in rows]
+        codes = await crud.list_of_codes(db=db, user = current_user)
+        return [
+            {
+                "code": code.code,
+                "tester_name": code.tester_name,
+                "requested_at": code.requested_at,
+                "reservation_token": code.reservation_token,
+                "status": code.status.value,
+                "note": code.note,
+                "countries": [c.name for c in code.countries],
+                "regions": list({c.region.name for c in code.countries if c.region}),  # dedupe regions
+            }
+            for code in codes
+        ]
     except NoCodesAvailableError:
         return json_error(409, "no_codes_available", "No codes available right now.")
     except Exception:
@@ -91,26 +163,31 @@ async def list_my_codes( current_user = Depends(user_required)):
 @router.post("/release")
 async def release_code(
     payload: BatchCodes,
-    current_user: User = Depends(user_required)
+    current_user: Principal = Depends(user_required),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                    released = crud.release_reserved_code(
-                        db=db,
-                        code=payload.code,
-                        clearance_id=payload.clearance_id,
-                        note=payload.note,
-                        user=current_user,
-                    )
-                    db.commit()
-                    return released
-                except Exception as e:
-                    db.rollback()
-                    raise e
-        released = await run_in_threadpool(work)
-        return {"released": released, "requested": payload.code, "clearance_id": payload.clearance_id}
+        replay = idempotency.lookup(current_user.id, idempotency_key, "release")
+        if replay:
+            return replay.to_response()
+
+        async def release(db):
+            released = await crud.release_reserved_code(
+                db=db,
+                code=payload.code,
+                clearance_id=payload.clearance_id,
+                note=payload.note,
+                user=current_user,
+            )
+            return {"released": released, "requested": payload.code, "clearance_id": payload.clearance_id}
+
+        result = await idempotency.run_idempotent_async(db, current_user.id, idempotency_key, "release", release)
+        await db.commit()
+        idempotency.remember(current_user.id, idempotency_key, result)
+        return result.to_response()
+    except IdempotencyKeyReusedError as e:
+        return json_error(409, "idempotency_key_reused", e.message)
     except ValueError:
         return json_error(404,f"Code '{payload.code}' not found.","Failed to release reserved codes.")
     except Exception:
@@ -118,64 +195,90 @@ async def release_code(
         return json_error(500, "release_reserved_failed", "Failed to release reserved codes.")
 
 
-@router.get("/logs", response_model=LogsResponse)
-async def get_user_logs(user: User =Depends(user_required),):
+@router.post("/release/batch", response_model=BatchReleaseResponse)
+async def release_codes(
+    payload: BatchReleaseRequest,
+    current_user: Principal = Depends(user_required),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+    db: AsyncSession = Depends(get_async_db),
+):
     try:
-        def work():
-            with session_factory() as db:
-                return crud.user_logs(db=db,user_id=user.id)
-        logs = await run_in_threadpool(work)
-        logs_response = [LogSchema.from_orm(log) for log in logs]
-        return LogsResponse(logs=logs_response)
-    except Exception as e:
-        raise e
+        replay = idempotency.lookup(current_user.id, idempotency_key, "release_batch")
+        if replay:
+            return replay.to_response()
 
+        async def release(db):
+            released = await crud.release_reserved_codes(
+                db=db,
+                user=current_user,
+                codes=None if payload.all else payload.codes,
+                clearance_id=payload.clearance_id,
+                note=payload.note,
+            )
+            requested = released if payload.all else payload.codes
+            done = set(released)
+            return BatchReleaseResponse(
+                released=len(released),
+                results=[{"code": c, "status": "released" if c in done else "not_reserved"} for c in requested],
+                clearance_id=payload.clearance_id,
+            )
+
+        result = await idempotency.run_idempotent_async(db, current_user.id, idempotency_key, "release_batch", release)
+        await db.commit()
+        idempotency.remember(current_user.id, idempotency_key, result)
+        return result.to_response()
+    except IdempotencyKeyReusedError as e:
+        return json_error(409, "idempotency_key_reused", e.message)
+    except Exception:
+        logger.exception("release_batch_failed")
+        return json_error(500, "release_reserved_failed", "Failed to release reserved codes.")
 
-@router.get("/countries",response_model=list[GetAllCountriesResponse])
-async def get_all_countries(_=Depends(user_required),):
-    try:
-        def work():
-            with session_factory() as db:
-                return crud.get_all_countries(db)
 
-        result = await run_in_threadpool(work)
-        return [{"id": row.id, "country": row.name} for row in result]
+@router.get("/logs", response_model=LogsResponse)
+async def get_user_logs(user: Principal = Depends(user_required), db: AsyncSession = Depends(get_async_db)):
+    logs = await crud.user_logs(db=db,user_id=user.id)
+    logs_response = [LogSchema.from_orm(log) for log in logs]
+    return LogsResponse(logs=logs_response)
 
 
-    except Exception as e:
-        raise e
+@router.get("/countries",response_model=list[GetAllCountriesResponse])
+async def get_all_countries(_=Depends(user_required), db: AsyncSession = Depends(get_async_db)):
+    result = await crud.get_all_countries(db)
+    return [{"id": row.id, "country": row.name} for row in result]
 
 
 @router.post("/comment")
 async def add_or_update_comment(
         payload: CodeCommentPayload,
-        _: User = Depends(user_required)
+        current_user: Principal = Depends(user_required),
+        idempotency_key: Optional[str] = Depends(idempotency_key_header),
+        db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        def work():
-            with session_factory() as db:
-                try:
-                    commented = crud.add_or_update_comment(
-                        db=db,
-                        code=payload.code,
-                        comment=payload.comment,
-                    )
-                    db.commit()
-                    return commented
-                except Exception as e:
-                    db.rollback()
-                    raise e
-
-        commented = await run_in_threadpool(work)
-        return {
-            "code": payload.code,
-            "comment": commented.note,
-            "message": "Comment added or updsated successfully."
-        }
+        replay = idempotency.lookup(current_user.id, idempotency_key, "comment")
+        if replay:
+            return replay.to_response()
+
+        async def comment(db):
+            commented = await crud.add_or_update_comment(
+                db=db,
+                code=payload.code,
+                comment=payload.comment,
+            )
+            return {
+                "code": payload.code,
+                "comment": commented.note,
+                "message": "Comment added or updsated successfully."
+            }
+
+        result = await idempotency.run_idempotent_async(db, current_user.id, idempotency_key, "comment", comment)
+        await db.commit()
+        idempotency.remember(current_user.id, idempotency_key, result)
+        return result.to_response()
+    except IdempotencyKeyReusedError as e:
+        return json_error(409, "idempotency_key_reused", e.message)
     except ValueError:
         return json_error(404, f"Code '{payload.code}' not found.", "Failed to add or update comment.")
     except Exception:
         logger.exception("add_or_update_comment failed")
         return json_error(500, "comment_update_failed", "Failed to add or update comment.")
-
-
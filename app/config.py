@@ -6,6 +6,93 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 480
     RESERVATION_TTL_MINUTES: int = 5
+    # Background release of reservations older than RESERVATION_TTL_MINUTES
+    RESERVATION_SWEEP_INTERVAL_SECONDS: int = 60
+    RESERVATION_SWEEP_BATCH_SIZE: int = 500
+    RESERVATION_SWEEP_MAX_BATCHES: int = 20
+    # "window": pick randomly among the oldest RESERVE_WINDOW_SIZE free codes so concurrent
+    # reservers don't pile up on the same head rows; "head": strict oldest-first
+    RESERVE_SELECTION: str = "window"
+    RESERVE_WINDOW_SIZE: int = 64
+    # Upper bound for ReserveRequest.wait_seconds, and how often a parked request re-checks the pool
+    RESERVE_WAIT_MAX_SECONDS: int = 60
+    RESERVE_WAIT_POLL_SECONDS: float = 5
+    # Idempotency-Key results: kept this long in the database, with an in-process LRU in front
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_CACHE_SIZE: int = 10000
+    # Authenticated callers are cached per worker; changes made on another worker show up within the TTL
+    PRINCIPAL_CACHE_TTL_SECONDS: float = 30
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    # Verified JWTs are cached until their exp so the signature isn't re-checked on every request
+    TOKEN_CACHE_ENABLED: bool = True
+    TOKEN_CACHE_SIZE: int = 4096
+    # bcrypt runs on its own process pool; more than PASSWORD_HASH_MAX_PENDING queued calls get a 503
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 2
+    # Per-worker buffer of pre-claimed codes per (code_type, country) pool. HOLD_SECONDS must stay below
+    # RESERVATION_TTL_MINUTES * 60, or the stale-reservation sweep releases live holds
+    RESERVATION_BUFFER_ENABLED: bool = False
+    RESERVATION_BUFFER_BATCH: int = 10
+    RESERVATION_BUFFER_LOW_WATER: int = 3
+    RESERVATION_BUFFER_HOLD_SECONDS: int = 60
+    # How often the trigger-maintained pool counters are checked against the codes table
+    POOL_COUNTER_RECONCILE_INTERVAL_SECONDS: int = 600
+    # How /admin/logs computes total_count when the request doesn't say: "exact" runs count(),
+    # "estimated" takes the planner's row estimate, "cached" keeps per-filter totals for the TTL
+    # and tops them up with rows logged since (rows committed out of id order are missed until
+    # the TTL runs out, so it is opt-in)
+    LOG_COUNT_MODE: str = "exact"
+    LOG_COUNT_CACHE_TTL_SECONDS: float = 60
+    LOG_COUNT_CACHE_SIZE: int = 1024
+    # Codes COPYed and inserted per statement by bulk code ingestion; failed codes beyond
+    # CODE_INGEST_MAX_FAILED are only counted in the response's failed_count
+    CODE_INGEST_CHUNK: int = 20000
+    CODE_INGEST_MAX_FAILED: int = 1000
+    # Rows per server-side cursor round trip when /admin/codes/all streams the code listing
+    CODES_LISTING_CHUNK: int = 5000
+    # /admin/logs/export fetches this many rows per server-side cursor round trip and compresses
+    # with this gzip level when the client accepts it (GZipMiddleware's level 9 is too slow for exports)
+    LOG_EXPORT_CHUNK: int = 2000
+    LOG_EXPORT_GZIP_LEVEL: int = 5
+    # logs is partitioned by month: partitions are created this many months ahead, and ones that ended
+    # more than LOG_RETENTION_MONTHS ago (0 keeps everything) are detached, or dropped with "drop"
+    LOG_PARTITIONS_AHEAD: int = 3
+    LOG_RETENTION_MONTHS: int = 0
+    LOG_RETENTION_ACTION: str = "detach"
+    LOG_PARTITION_INTERVAL_SECONDS: int = 3600
+    # Write-behind audit log: crud appends log rows to the unindexed log_outbox table and each worker
+    # moves them into logs in batches of LOG_OUTBOX_BATCH, at least every LOG_OUTBOX_FLUSH_SECONDS
+    LOG_WRITE_BEHIND: bool = False
+    LOG_OUTBOX_BATCH: int = 5000
+    LOG_OUTBOX_FLUSH_SECONDS: float = 1.0
+    # Hourly usage rollups behind /admin/stats: hours are rolled up once they closed SETTLE seconds ago
+    # (keep it above the write-behind log lag), at most MAX_HOURS per run
+    USAGE_ROLLUP_INTERVAL_SECONDS: int = 300
+    USAGE_ROLLUP_SETTLE_SECONDS: int = 120
+    USAGE_ROLLUP_MAX_HOURS: int = 168
+    # Connection pools. Request handlers use the async pool; the sync one serves background jobs,
+    # scripts and the reservation buffer, and the worker threadpool is sized to match it
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 10
+    SYNC_DB_POOL_SIZE: int = 10
+    SYNC_DB_MAX_OVERFLOW: int = 5
+    # Admission control per route class. The *_LIMIT values are ceilings for the adaptive concurrency
+    # limits and together should not exceed DB_POOL_SIZE + DB_MAX_OVERFLOW. Requests over the limit
+    # queue (up to *_MAX_QUEUE, for *_QUEUE_TIMEOUT_SECONDS) and are then shed with a 503
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_WRITES_LIMIT: int = 16
+    ADMISSION_WRITES_LATENCY_TARGET_MS: float = 250
+    ADMISSION_READS_LIMIT: int = 10
+    ADMISSION_READS_LATENCY_TARGET_MS: float = 500
+    ADMISSION_MAX_QUEUE: int = 64
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 2
+    ADMISSION_BULK_LIMIT: int = 4
+    ADMISSION_BULK_LATENCY_TARGET_MS: float = 5000
+    ADMISSION_BULK_MAX_QUEUE: int = 8
+    ADMISSION_BULK_QUEUE_TIMEOUT_SECONDS: float = 10
+    ADMISSION_RETRY_AFTER_SECONDS: int = 1
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from fastapi.responses import JSONResponse
+
+from app.config import settings
+from app.core.exceptions import ServiceOverloadedError
+
+
+class AdmissionClass:
+    """
+    Concurrency limit for one class of routes. Requests over the limit wait
+    in a FIFO queue of at most max_queue for up to queue_timeout seconds;
+    anything beyond that is shed with ServiceOverloadedError.
+
+    The limit adapts AIMD-style between min_limit and max_limit: it grows by
+    1/limit for every request served within latency_target and is cut by
+    decrease_factor (at most once per latency_target) when one is slower.
+    max_limit is the class's share of the database pool, so admitted
+    requests don't sit in pool_timeout waiting for a connection.
+    """
+
+    def __init__(self, name: str, max_limit: int, latency_target: float,
+                 max_queue: int, queue_timeout: float, retry_after: int,
+                 min_limit: int = 1, decrease_factor: float = 0.9):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(max_limit)
+        self.latency_target = latency_target
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.decrease_factor = decrease_factor
+        self.inflight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.avg_wait = 0.0
+        self.avg_latency = 0.0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self, shed: bool = True):
+        """
+        Take a slot, queueing if the class is at its limit. With shed=False
+        the caller waits for a slot however long it takes and is never
+        rejected (used to resume a request that already got in once).
+        """
+        started = time.monotonic()
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+        else:
+            if shed and len(self._waiters) >= self.max_queue:
+                self._reject("queue full")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.queue_timeout if shed else None)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just as we gave up; pass it on
+                    self.release(None)
+                else:
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                if isinstance(e, asyncio.TimeoutError):
+                    self._reject("queue wait exceeded")
+                raise
+        self.admitted += 1
+        self.avg_wait += 0.2 * ((time.monotonic() - started) - self.avg_wait)
+
+    def release(self, latency: float | None):
+        """Give the slot back; latency (seconds held) feeds the adaptive limit."""
+        self.inflight -= 1
+        if latency is not None:
+            self.avg_latency += 0.2 * (latency - self.avg_latency)
+            now = time.monotonic()
+            if latency > self.latency_target:
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "max_limit": self.max_limit,
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_queue_wait_ms": round(self.avg_wait * 1000, 2),
+            "avg_latency_ms": round(self.avg_latency * 1000, 2),
+        }
+
+    def _wake(self):
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    def _reject(self, reason: str):
+        self.shed += 1
+        raise ServiceOverloadedError(f"Too many {self.name} requests ({reason})", retry_after=self.retry_after)
+
+
+@dataclass
+class _Lease:
+    admission_class: AdmissionClass
+    started: float = field(default_factory=time.monotonic)
+    # Set for untimed streams, or once the request gave its slot up while parked; either way its
+    # latency says nothing about load
+    suspended: bool = False
+
+
+_current_lease: ContextVar[_Lease | None] = ContextVar("admission_lease", default=None)
+
+# Never limited: auth is bounded by the password hasher, and metrics must stay reachable under load
+_EXEMPT_PREFIXES = ("/auth/", "/admin/metrics", "/docs", "/redoc", "/openapi.json")
+_BULK_PREFIXES = ("/admin/users/bulk", "/admin/codes/add", "/admin/logs/export")
+# Long streams whose duration says nothing about load; they hold a slot but don't feed the adaptive limit
+_UNTIMED_PREFIXES = ("/admin/logs/export", "/admin/codes/all")
+
+
+class AdmissionController:
+    def __init__(self, classes: list[AdmissionClass]):
+        self.classes = {c.name: c for c in classes}
+
+    def classify(self, method: str, path: str) -> AdmissionClass | None:
+        if method == "OPTIONS" or path.startswith(_EXEMPT_PREFIXES):
+            return None
+        if path.startswith(_BULK_PREFIXES):
+            return self.classes["bulk"]
+        if method in ("GET", "HEAD"):
+            return self.classes["reads"]
+        return self.classes["writes"]
+
+    @asynccontextmanager
+    async def suspended(self):
+        """
+        Give the current request's slot back while it waits on something
+        that is not this server's capacity (a parked reservation), and take
+        one again, without being shed, before continuing.
+        """
+        lease = _current_lease.get()
+        if lease is None:
+            yield
+            return
+        lease.suspended = True
+        lease.admission_class.release(None)
+        try:
+            yield
+        finally:
+            await lease.admission_class.acquire(shed=False)
+
+    def stats(self) -> dict:
+        return {name: c.stats() for name, c in self.classes.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting each request through its route class."""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        admission_class = self.controller.classify(scope["method"], scope["path"])
+        if admission_class is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            await admission_class.acquire()
+        except ServiceOverloadedError as e:
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": e.message},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        lease = _Lease(admission_class, suspended=scope["path"].startswith(_UNTIMED_PREFIXES))
+        token = _current_lease.set(lease)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_lease.reset(token)
+            admission_class.release(None if lease.suspended else time.monotonic() - lease.started)
+
+
+admission = AdmissionController([
+    AdmissionClass("writes", settings.ADMISSION_WRITES_LIMIT, settings.ADMISSION_WRITES_LATENCY_TARGET_MS / 1000,
+                   settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                   settings.ADMISSION_RETRY_AFTER_SECONDS),
+    AdmissionClass("reads", settings.ADMISSION_READS_LIMIT, settings.ADMISSION_READS_LATENCY_TARGET_MS / 1000,
+                   settings.ADMISSION_MAX_QUEUE, settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                   settings.ADMISSION_RETRY_AFTER_SECONDS),
+    AdmissionClass("bulk", settings.ADMISSION_BULK_LIMIT, settings.ADMISSION_BULK_LATENCY_TARGET_MS / 1000,
+                   settings.ADMISSION_BULK_MAX_QUEUE, settings.ADMISSION_BULK_QUEUE_TIMEOUT_SECONDS,
+                   settings.ADMISSION_RETRY_AFTER_SECONDS),
+])
@@ -46,3 +46,12 @@ class UserNotFound(AppError):
 
 class UserHasReservedCodesError(AppError):
     """raised when the admin tries to delete the user, but the user has some reserved codes"""
+
+class IdempotencyKeyReusedError(AppError):
+    """raised when an Idempotency-Key is sent again for a different endpoint"""
+
+class ServiceOverloadedError(AppError):
+    """raised when a bounded worker pool is full and the request is shed instead of queued"""
+    def __init__(self, message: str | None = None, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.config import settings
+from app.core import security
+from app.core.exceptions import ServiceOverloadedError
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasher:
+    """
+    bcrypt hashing/verification on a dedicated process pool, so a burst of
+    logins runs in parallel on other cores instead of occupying the
+    threadpool that serves reservations. At most max_pending calls may be
+    queued or running; beyond that callers get ServiceOverloadedError (503)
+    right away rather than waiting behind the burst.
+
+    Admission is counted on the event loop, so the coroutines must be
+    awaited from async handlers.
+    """
+
+    def __init__(self, workers: int, max_pending: int, retry_after_seconds: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after_seconds = retry_after_seconds
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self):
+        if self._executor is None:
+            # spawn, not fork: the parent has live threads and pooled connections
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def hash(self, password: str) -> str:
+        return await self._run(security.get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(security.verify_password, plain_password, hashed_password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        """
+        Hash a batch across all workers. The batch takes one admission slot
+        and is fed to the pool one round (one password per worker) at a time,
+        so logins arriving meanwhile wait at most a round, not the whole batch.
+        """
+        self._admit()
+        self.start()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            hashes: list[str] = []
+            for i in range(0, len(passwords), self.workers):
+                hashes += await asyncio.gather(*(
+                    loop.run_in_executor(self._executor, security.get_password_hash, p)
+                    for p in passwords[i:i + self.workers]
+                ))
+            self.completed += len(passwords)
+            return hashes
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def _admit(self):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ServiceOverloadedError("Password hashing is saturated", retry_after=self.retry_after_seconds)
+
+    async def _run(self, fn, *args):
+        self._admit()
+        self.start()
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            self.completed += 1
+            return result
+        finally:
+            self.pending -= 1
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    retry_after_seconds=settings.PASSWORD_HASH_RETRY_AFTER_SECONDS,
+)
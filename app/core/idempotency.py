@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.core.exceptions import IdempotencyKeyReusedError
+from app.db.users import async_crud
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    endpoint: str
+    status_code: int
+    body: Any
+    replayed: bool = False
+
+    def to_response(self) -> JSONResponse:
+        headers = {"Idempotent-Replayed": "true"} if self.replayed else None
+        return JSONResponse(content=self.body, status_code=self.status_code, headers=headers)
+
+
+class IdempotencyCache:
+    """Bounded LRU of recent (user_id, key) -> response, entries expire after ttl_seconds."""
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple[int, str], tuple[float, StoredResponse]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, key: str) -> StoredResponse | None:
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None:
+                return None
+            stored_at, response = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[(user_id, key)]
+                return None
+            self._entries.move_to_end((user_id, key))
+            return response
+
+    def put(self, user_id: int, key: str, response: StoredResponse):
+        with self._lock:
+            self._entries[(user_id, key)] = (time.monotonic(), response)
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+idempotency_cache = IdempotencyCache(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_TTL_SECONDS)
+
+
+def lookup(user_id: int, key: str | None, endpoint: str) -> StoredResponse | None:
+    """In-process replay check, done before touching the database."""
+    if not key:
+        return None
+    cached = idempotency_cache.get(user_id, key)
+    if cached is None:
+        return None
+    if cached.endpoint != endpoint:
+        raise IdempotencyKeyReusedError(f"Idempotency-Key already used for '{cached.endpoint}'")
+    return StoredResponse(cached.endpoint, cached.status_code, cached.body, replayed=True)
+
+
+async def run_idempotent_async(
+    db: AsyncSession,
+    user_id: int,
+    key: str | None,
+    endpoint: str,
+    fn: Callable[[AsyncSession], Awaitable[Any]],
+) -> StoredResponse:
+    """
+    Await fn(db) at most once per (user_id, key) and return its JSON body.
+    The result is stored in the caller's transaction, so it becomes visible
+    exactly when the work itself commits; failed requests leave no trace and
+    may be retried with the same key. Without a key fn just runs.
+    """
+    if key:
+        previous = await async_crud.claim_idempotency_key(db, user_id, key, endpoint)
+        if previous is not None:
+            if previous.endpoint != endpoint:
+                raise IdempotencyKeyReusedError(f"Idempotency-Key already used for '{previous.endpoint}'")
+            return StoredResponse(endpoint, previous.status_code, previous.response, replayed=True)
+
+    body = jsonable_encoder(await fn(db))
+    if key:
+        await async_crud.store_idempotent_response(db, user_id, key, 200, body)
+    return StoredResponse(endpoint, 200, body)
+
+
+def remember(user_id: int, key: str | None, response: StoredResponse):
+    """Cache a committed response for fast replays."""
+    if key:
+        idempotency_cache.put(user_id, key, StoredResponse(response.endpoint, response.status_code, response.body))
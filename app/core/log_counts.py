@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+
+class LogCountCache:
+    """
+    Bounded LRU of /admin/logs filter signature -> (total, high_water), where
+    high_water is the largest log id the total covers. Logs are only ever
+    appended, so a reader that sees a newer max(id) tops the total up by
+    counting just the rows above high_water instead of recounting. Entries
+    expire ttl_seconds after the full count, which bounds the drift from
+    rows committed out of id order or removed by retention.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.top_ups = 0
+        self._entries: OrderedDict[tuple, tuple[float, int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[int, int] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: tuple, total: int, high_water: int):
+        """Store a full count, starting a new TTL."""
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), total, high_water)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def advance(self, key: tuple, total: int, high_water: int):
+        """Store a topped-up count; the TTL still runs from the last full count."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < high_water:
+                self._entries[key] = (entry[0], total, high_water)
+                self.top_ups += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {"size": size, "hits": self.hits, "misses": self.misses, "top_ups": self.top_ups}
+
+
+log_count_cache = LogCountCache(settings.LOG_COUNT_CACHE_SIZE, settings.LOG_COUNT_CACHE_TTL_SECONDS)
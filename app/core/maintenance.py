@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Callable
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import ddl
+from app.db.engine import SessionLocal
+from app.db.admin import crud as admin_crud
+from app.db.users import crud as users_crud
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock keys, one per cluster-wide job
+EXPIRY_LOCK_KEY = 7_240_001
+IDEMPOTENCY_PURGE_LOCK_KEY = 7_240_002
+POOL_COUNTER_LOCK_KEY = 7_240_003
+LOG_PARTITION_LOCK_KEY = ddl.LOG_PARTITION_LOCK_KEY
+USAGE_ROLLUP_LOCK_KEY = 7_240_005
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    skipped: int = 0
+    errors: int = 0
+    last_started_at: float | None = None
+    last_duration_ms: float | None = None
+    last_result: int | None = None
+    total_result: int = 0
+
+
+@dataclass
+class PeriodicJob:
+    name: str
+    interval_seconds: float
+    fn: Callable[[], int | None]
+    stats: JobStats = field(default_factory=JobStats)
+
+
+class Maintenance:
+    """
+    Runs background jobs on fixed intervals from the app lifespan.
+    Each job is a blocking callable executed in the threadpool; it returns
+    the number of rows it handled, or None when another node held its lock.
+    """
+
+    def __init__(self):
+        self._jobs: dict[str, PeriodicJob] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def add(self, name: str, interval_seconds: float, fn: Callable[[], int | None]):
+        self._jobs[name] = PeriodicJob(name, interval_seconds, fn)
+
+    async def start(self):
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"maintenance:{job.name}"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def run(self, name: str) -> int | None:
+        job = self._jobs[name]
+        stats = job.stats
+        stats.last_started_at = time.time()
+        started = time.perf_counter()
+        try:
+            result = await run_in_threadpool(job.fn)
+        except Exception:
+            stats.errors += 1
+            logger.exception("maintenance_job_failed: %s", name)
+            return None
+        if result is None:
+            stats.skipped += 1
+            return None
+        stats.runs += 1
+        stats.last_duration_ms = round((time.perf_counter() - started) * 1000, 2)
+        stats.last_result = result
+        stats.total_result += result
+        return result
+
+    def stats(self) -> dict:
+        return {name: asdict(job.stats) for name, job in self._jobs.items()}
+
+    async def _loop(self, job: PeriodicJob):
+        while True:
+            await asyncio.sleep(job.interval_seconds)
+            await self.run(job.name)
+
+
+def run_exclusive(lock_key: int, fn: Callable[[Session], int]) -> int | None:
+    """
+    Run fn(db) in its own transaction, but only if this node wins the
+    transaction-scoped advisory lock; returns None otherwise.
+    """
+    with SessionLocal() as db:
+        try:
+            if not db.execute(select(func.pg_try_advisory_xact_lock(lock_key))).scalar():
+                return None
+            result = fn(db)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+
+
+def expire_reservations() -> int | None:
+    """Release stale reservations in bounded batches until a batch comes back short."""
+    reclaimed = 0
+    for _ in range(settings.RESERVATION_SWEEP_MAX_BATCHES):
+        released = run_exclusive(EXPIRY_LOCK_KEY, users_crud.expire_stale_reservations)
+        if released is None:
+            return reclaimed or None
+        reclaimed += len(released)
+        if len(released) < settings.RESERVATION_SWEEP_BATCH_SIZE:
+            break
+    if reclaimed:
+        logger.info("expired %d stale reservations", reclaimed)
+    return reclaimed
+
+
+def purge_idempotency_keys() -> int | None:
+    return run_exclusive(IDEMPOTENCY_PURGE_LOCK_KEY, users_crud.purge_idempotency_keys)
+
+
+def reconcile_pool_counters() -> int | None:
+    return run_exclusive(POOL_COUNTER_LOCK_KEY, admin_crud.reconcile_pool_counters)
+
+
+def _manage_log_partitions(db: Session) -> int:
+    # Partition DDL briefly locks logs; give up and retry next round rather than stall log writes
+    db.execute(text("SET LOCAL lock_timeout = '5s'"))
+    return ddl.manage_log_partitions(db)
+
+
+def manage_log_partitions() -> int | None:
+    return run_exclusive(LOG_PARTITION_LOCK_KEY, _manage_log_partitions)
+
+
+def rollup_usage() -> int | None:
+    return run_exclusive(USAGE_ROLLUP_LOCK_KEY, admin_crud.rollup_usage)
+
+
+maintenance = Maintenance()
+maintenance.add("expire_reservations", settings.RESERVATION_SWEEP_INTERVAL_SECONDS, expire_reservations)
+maintenance.add("purge_idempotency_keys", 3600, purge_idempotency_keys)
+maintenance.add("reconcile_pool_counters", settings.POOL_COUNTER_RECONCILE_INTERVAL_SECONDS, reconcile_pool_counters)
+maintenance.add("manage_log_partitions", settings.LOG_PARTITION_INTERVAL_SECONDS, manage_log_partitions)
+maintenance.add("rollup_usage", settings.USAGE_ROLLUP_INTERVAL_SECONDS, rollup_usage)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db.models import User
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """The authenticated caller, detached from any session; handlers only read these fields."""
+    id: int
+    user_name: str
+    team_name: str
+    contact_email: str
+    is_admin: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            user_name=user.user_name,
+            team_name=user.team_name,
+            contact_email=user.contact_email,
+            is_admin=bool(user.is_admin),
+        )
+
+
+class PrincipalCache:
+    """
+    Bounded LRU of user_id -> Principal, entries expire after ttl_seconds.
+    Changes made by this worker invalidate their entry; other workers pick
+    them up once the TTL runs out.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[float, Principal]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Principal | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, principal: Principal):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[principal.id] = (time.monotonic(), principal)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_on_commit(self, db: Session, user_id: int):
+        """
+        Drop the entry now and again once db commits, so a request that
+        reloads the user in between can't re-cache the old row.
+        """
+        self.invalidate(user_id)
+        event.listen(db, "after_commit", lambda _session: self.invalidate(user_id), once=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {"size": size, "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS)
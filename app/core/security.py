@@ -1,3 +1,6 @@
+import threading
+import time
+from collections import OrderedDict
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import jwt
@@ -30,5 +33,60 @@ def create_access_token(
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 
+class TokenCache:
+    """
+    Bounded LRU of token -> verified claims. Only tokens that passed
+    jwt.decode are stored, and an entry is dropped once its exp passes, so a
+    hit is exactly what decoding again would have returned.
+    """
+
+    def __init__(self, max_size: int, enabled: bool = True):
+        self.max_size = max_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> dict | None:
+        with self._lock:
+            claims = self._entries.get(token)
+            if claims is None or claims.get("exp", 0) <= time.time():
+                self._entries.pop(token, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict):
+        # Tokens without exp never expire on their own; don't pin them in memory
+        if "exp" not in claims:
+            return
+        with self._lock:
+            self._entries[token] = claims
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {"enabled": self.enabled, "size": size, "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, enabled=settings.TOKEN_CACHE_ENABLED)
+
+
 def decode_token(token: str) -> dict:
-    return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    if not token_cache.enabled:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        token_cache.put(token, claims)
+    return dict(claims)
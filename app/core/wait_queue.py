@@ -0,0 +1,110 @@
+import asyncio
+import itertools
+import json
+import logging
+
+import psycopg
+from sqlalchemy.engine import make_url
+
+from app.config import settings
+from app.db.models import CodeType
+from app.db.pool_events import CODE_POOL_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class PoolWaitQueue:
+    """
+    Parks reservation requests per (code_type, country) pool until codes come
+    back, waking waiters oldest-first. Wake-ups arrive over Postgres
+    LISTEN/NOTIFY (see app.db.pool_events), so a release on any worker wakes
+    waiters on all of them.
+    """
+
+    def __init__(self, poll_seconds: float):
+        # Re-check the pool at least this often in case a notification is missed
+        self.poll_seconds = poll_seconds
+        self._waiters: dict[tuple, list[tuple[int, asyncio.Future]]] = {}
+        self._seq = itertools.count()
+        self._listener: asyncio.Task | None = None
+
+    @staticmethod
+    def _key(code_type, country):
+        ct = CodeType(code_type) if isinstance(code_type, str) else code_type
+        # COMMON codes ignore the country
+        return ct, (None if ct == CodeType.COMMON else country)
+
+    async def wait(self, code_type, country, timeout: float, ticket: int | None = None) -> int:
+        """
+        Park until woken or `timeout` elapses. Returns the waiter's ticket;
+        pass it back when waiting again so the waiter keeps its place in line.
+        """
+        key = self._key(code_type, country)
+        ticket = next(self._seq) if ticket is None else ticket
+        fut = asyncio.get_running_loop().create_future()
+        queue = self._waiters.setdefault(key, [])
+        queue.append((ticket, fut))
+        queue.sort(key=lambda w: w[0])
+        try:
+            await asyncio.wait_for(fut, timeout=min(timeout, self.poll_seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if (ticket, fut) in queue:
+                queue.remove((ticket, fut))
+            if not queue and self._waiters.get(key) is queue:
+                del self._waiters[key]
+        return ticket
+
+    def wake(self, code_type: str | None, countries: list[str] | None, count: int):
+        """Wake up to `count` of the oldest waiters that the returned codes can serve."""
+        ct = CodeType(code_type) if code_type else None
+
+        def eligible(key):
+            key_ct, key_country = key
+            if ct is None or ct == CodeType.COMMON:
+                return True
+            return key_ct == ct and (not countries or key_country is None or key_country in countries)
+
+        queues = [q for key, q in self._waiters.items() if eligible(key)]
+        for _ in range(count):
+            heads = [q for q in queues if q]
+            if not heads:
+                return
+            queue = min(heads, key=lambda q: q[0][0])
+            _, fut = queue.pop(0)
+            if not fut.done():
+                fut.set_result(True)
+
+    def depth(self) -> dict:
+        return {f"{ct.value}:{country or '*'}": len(q) for (ct, country), q in self._waiters.items()}
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen(), name="code-pool-listener")
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    async def _listen(self):
+        conninfo = make_url(settings.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {CODE_POOL_CHANNEL}")
+                    async for note in conn.notifies():
+                        try:
+                            payload = json.loads(note.payload)
+                            self.wake(payload.get("code_type"), payload.get("countries"), int(payload.get("count", 1)))
+                        except (ValueError, TypeError):
+                            logger.warning("ignoring malformed %s payload: %r", CODE_POOL_CHANNEL, note.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("code_pool_listener_failed, reconnecting")
+                await asyncio.sleep(5)
+
+
+pool_waiters = PoolWaitQueue(poll_seconds=settings.RESERVE_WAIT_POLL_SECONDS)
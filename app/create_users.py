@@ -24,28 +24,29 @@ async def admin_login(client):
     token = r.json().get("access_token")
     return token
 
-async def create_user(client, token, team_name, user_name, contact_email, password, is_admin=False):
-    data = {
-        "team_name": team_name,
-        "user_name": user_name,
-        "contact_email": contact_email,
-        "password": password,
+def new_user(num):
+    return {
+        "team_name": random.choice(teams),
+        "user_name": random_username(),
+        "contact_email": random_email(num),
+        "password": PASSWORD,
         "is_admin": False
     }
+
+async def create_users(client, token, users):
     headers = {"Authorization": f"Bearer {token}"}
-    response = await client.post(f"{BASE_URL}/admin/users/create", params=data, headers=headers)
-    print(f"Create user {user_name}: {response.status_code} - {response.text}")
+    response = await client.post(f"{BASE_URL}/admin/users/bulk", json={"users": users}, headers=headers)
+    response.raise_for_status()
+    result = response.json()
+    for user in result["created"]:
+        print(f"Created user {user['user_name']} <{user['contact_email']}>")
+    for user in result["skipped"]:
+        print(f"Skipped {user['contact_email']}: {user['reason']}")
 
 async def main():
-    async with httpx.AsyncClient(timeout=30) as client:
+    async with httpx.AsyncClient(timeout=300) as client:
         token = await admin_login(client)
-        tasks = []
-        for i in range(40):
-            team_name = random.choice(teams)
-            user_name = random_username()
-            email = random_email(i)
-            tasks.append(create_user(client, token, team_name, user_name, email, PASSWORD))
-        await asyncio.gather(*tasks)
+        await create_users(client, token, [new_user(i) for i in range(40)])
 
 if __name__ == "__main__":
     asyncio.run(main())
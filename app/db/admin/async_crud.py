@@ -0,0 +1,383 @@
+"""
+AsyncSession versions of the crud used by the admin request handlers.
+
+Statements are built by the helpers in app.db.admin.crud, which otherwise
+only keeps the pool counter reconciliation and usage rollups run by the
+maintenance jobs on the sync engine.
+"""
+import re
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import false, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.core.exceptions import NoCodesAvailableError, UserHasReservedCodesError, UserNotFound
+from app.core.principal import principal_cache
+from app.config import settings
+from app.core.log_counts import log_count_cache
+from app.db.admin.crud import (CODE_INGEST_TABLE, LogPage, _CODE_INGEST_COPY, _CODE_INGEST_DDL, _bulk_add_result,
+                               _bulk_create_users_stmt, _check_code_type, _chunked, _code_count_stmt, _copy_payload,
+                               _ingest_stmt, _log_count_key, _log_count_stmt, _normalize_codes, _resolve_countries,
+                               _record_failed, _log_estimate_sql, _log_export_stmt, _log_filters, _log_page, _log_page_stmt,
+                               _plan_rows, usage_hour, _usage_stats_stmt, USAGE_ROLLUP,
+                               _codes_listing_stmt, _codes_next_cursor_stmt, encode_codes_cursor)
+from app.db.models import Code, CodeAction, CodeStatus, CodeType, Country, Log, RollupWatermark, User, code_countries
+from app.db.pool_events import notify_codes_returned_async
+from app.db.log_outbox import log_table
+
+
+async def get_code_count(db: AsyncSession, code_type: Optional[str] = None, country: Optional[str] = None):
+    """
+    Code counts by status from the trigger-maintained pool_counters, optionally
+    narrowed to one code_type and/or one country.
+    """
+    rows = (await db.execute(_code_count_stmt(code_type, country))).all()
+    if not rows:
+        raise NoCodesAvailableError()
+    return {status: int(n) for status, n in rows}
+
+
+async def create_user(db: AsyncSession,
+                      team_name: str,
+                      user_name: str,
+                      contact_email: str,
+                      password: str,
+                      is_admin: bool
+                      ):
+    now = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
+    new_user = User(team_name=team_name,
+                    user_name=user_name,
+                    contact_email=contact_email,
+                    password_hash=password,
+                    is_admin=is_admin,
+                    created_at=now
+                    )
+    db.add(new_user)
+    return new_user
+
+
+async def existing_user_emails(db: AsyncSession, emails: Iterable[str]) -> set[str]:
+    emails = list(emails)
+    if not emails:
+        return set()
+    return set((await db.execute(select(User.contact_email).where(User.contact_email.in_(emails)))).scalars())
+
+
+async def bulk_create_users(db: AsyncSession, users: list[dict]) -> list:
+    """
+    Insert already-hashed users in one statement; emails that exist by the
+    time it runs are skipped. Returns the rows actually created.
+    """
+    return (await db.execute(_bulk_create_users_stmt(users))).all()
+
+
+async def fetch_users_with_reserved_codes(
+    db: AsyncSession,
+    *,
+    only_user_id: Optional[int] = None,
+) -> List[User]:
+    stmt = select(User).options(selectinload(User.codes.and_(Code.status == CodeStatus.RESERVED)))
+    if only_user_id is not None:
+        stmt = stmt.where(or_(User.id == only_user_id, User.is_admin == false()))
+    else:
+        stmt = stmt.where(User.is_admin == false())
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def update_user(
+        db: AsyncSession,
+        id: int,
+        team_name: str,
+        user_name: str,
+        contact_email: str,
+        password: str,
+        is_admin: bool
+):
+    user = await db.get(User, id)
+
+    if not user:
+        raise UserNotFound(f"User with id:{id} is not present in the database")
+
+    updates = {
+        "team_name": team_name,
+        "user_name": user_name,
+        "contact_email": contact_email,
+        "password": password,
+        "is_admin": is_admin,
+    }
+
+    for field, value in updates.items():
+        if value is not None:
+            setattr(user, field, value)
+    user.created_at = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
+    principal_cache.invalidate_on_commit(db.sync_session, user.id)
+    return user
+
+
+async def delete_user(db: AsyncSession, user_id: int):
+    result = (await db.execute(
+        select(
+            User,
+            func.count(Code.code).filter(Code.status == CodeStatus.RESERVED.value).label("reserved_count")
+        )
+        .outerjoin(Code, Code.user_id == User.id)
+        .where(User.id == user_id)
+        .group_by(User.id)
+    )).first()
+
+    if not result:
+        raise UserNotFound
+
+    user, reserved_count = result
+
+    if reserved_count > 0:
+        raise UserHasReservedCodesError(f"Action denied: user has reserved {reserved_count} code(s).")
+    await db.delete(user)
+    principal_cache.invalidate_on_commit(db.sync_session, user_id)
+
+
+async def _async_chunks(chunks: Iterable[List[str]]) -> AsyncIterator[List[str]]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def ingest_codes(
+    db: AsyncSession,
+    *,
+    code_type: str,
+    countries: Iterable[str] | None,
+    chunks: AsyncIterable[Iterable[str]],
+    user_name: str,
+    contact_email: str,
+    inserted_codes: Optional[List[str]] = None,
+    code_pattern: Optional[re.Pattern] = None,
+) -> Dict:
+    """
+    Add codes chunk by chunk: each chunk is COPYed into a temp table and
+    moved into codes, code_countries and logs by _ingest_stmt, so memory
+    and statement size stay bounded by the chunk size however many codes
+    arrive. Everything runs in the caller's transaction. Codes not matching
+    code_pattern, when given, are rejected as invalid_format.
+
+    Returns {"inserted": n, "failed": [(code, reason), ...], "failed_count": n,
+    "unknown_countries": [...], "attached": n (code, country) links}, where
+    failed holds at most CODE_INGEST_MAX_FAILED of the failed_count rejects;
+    pass a list as inserted_codes to also collect the inserted codes.
+    """
+    code_type = _check_code_type(code_type)
+    names = [c.strip() for c in (countries or []) if c and c.strip()]
+    country_map, unknown = _resolve_countries(
+        (await db.execute(select(Country.name, Country.id).where(Country.name.in_(names)))).all() if names else [],
+        names,
+    )
+    note = f"Code added for {code_type.value} / {', '.join(country_map) or 'ANY'}"
+    stmt = _ingest_stmt(code_type, list(country_map.values()), user_name, contact_email, note,
+                        datetime.now(ZoneInfo("Asia/Kolkata")))
+
+    result: Dict = {"inserted": 0, "failed": [], "failed_count": 0, "unknown_countries": unknown, "attached": 0}
+    staged = 0
+    await db.execute(text(_CODE_INGEST_DDL))
+    raw = (await (await db.connection()).get_raw_connection()).driver_connection
+    async for chunk in chunks:
+        codes = _normalize_codes(chunk, result, code_pattern)
+        if not codes:
+            continue
+        staged += len(codes)
+        await db.execute(text(f"TRUNCATE {CODE_INGEST_TABLE}"))
+        async with raw.cursor() as cursor:
+            async with cursor.copy(_CODE_INGEST_COPY) as copy:
+                await copy.write(_copy_payload(codes))
+        inserted = (await db.execute(stmt)).scalars().all()
+        result["inserted"] += len(inserted)
+        result["attached"] += len(inserted) * len(country_map)
+        if inserted_codes is not None:
+            inserted_codes.extend(inserted)
+        if len(inserted) < len(codes):
+            added = set(inserted)
+            _record_failed(result, ((code, "duplicate_in_db") for code in codes if code not in added))
+
+    if not staged:
+        raise ValueError("No valid codes to insert.")
+    await notify_codes_returned_async(db, result["inserted"], code_type=code_type,
+                                      countries=list(country_map) or None)
+    return result
+
+
+async def bulk_add_codes(
+    db: AsyncSession,
+    *,
+    code_type: str,
+    countries: Iterable[str] | None,
+    codes: Iterable[str],
+    user_name: str,
+    contact_email: str,
+) -> Dict:
+    """
+    Insert codes and associate each with zero or more countries.
+    Returns:
+      {
+        "inserted": [code, ...],               # actually inserted into codes table
+        "failed": [(code, reason), ...],       # validation or duplicate reasons
+        "failed_count": n,                     # all failed codes; "failed" keeps CODE_INGEST_MAX_FAILED
+        "unknown_countries": ["X", ...],       # country names not found in DB
+        "attached": {(code, country_name), ...}# associations created
+      }
+      - If a country name is unknown, code is still inserted, just no association for that name.
+    """
+    inserted_codes: List[str] = []
+    result = await ingest_codes(db, code_type=code_type, countries=countries,
+                                chunks=_async_chunks(_chunked(codes or [], settings.CODE_INGEST_CHUNK)),
+                                user_name=user_name, contact_email=contact_email, inserted_codes=inserted_codes)
+    known = [c.strip() for c in (countries or []) if c and c.strip() and c.strip() not in result["unknown_countries"]]
+    return _bulk_add_result(result, inserted_codes, dict.fromkeys(known))
+
+
+async def codes_next_cursor(db: AsyncSession, limit: int, **filters) -> Optional[str]:
+    """Cursor of the page after a `limit`-code page of get_codes_grouped, or None if it is the last."""
+    following = (await db.execute(_codes_next_cursor_stmt(limit, **filters))).all()
+    return encode_codes_cursor(*following[0]) if len(following) == 2 else None
+
+
+async def get_codes_grouped(
+    db: AsyncSession,
+    *,
+    code_type: Optional[CodeType] = None,
+    status: Optional[CodeStatus] = None,
+    country: Optional[str] = None,
+    cursor: Optional[str] = None,
+    until: Optional[str] = None,
+) -> AsyncIterator[list]:
+    """
+    Listed codes as chunks of (code_type, status, code) rows, streamed through
+    a server-side cursor. For a paged listing pass the page's codes_next_cursor
+    as until: the page then runs up to and including the row that cursor names
+    rather than stopping after limit rows, so codes added or moved between the
+    two queries still land on exactly one page.
+    """
+    stmt = _codes_listing_stmt(code_type=code_type, status=status, country=country, cursor=cursor, until=until)
+    result = await db.stream(stmt.execution_options(yield_per=settings.CODES_LISTING_CHUNK))
+    async for chunk in result.partitions():
+        yield chunk
+
+
+async def count_logs(db: AsyncSession, filters: list, key: tuple, mode: str) -> int:
+    """
+    Total logs matching filters, per LOG_COUNT_MODES. The cached mode reuses
+    log_count_cache[key] and counts only rows logged since (see LogCountCache).
+    """
+    if mode == "estimated":
+        sql, params = _log_estimate_sql(filters, db.get_bind().dialect)
+        conn = await db.connection()
+        return _plan_rows((await conn.exec_driver_sql(sql, params)).scalar())
+    if mode == "cached":
+        high_water = (await db.execute(select(func.max(Log.id)))).scalar() or 0
+        cached = log_count_cache.get(key)
+        if cached is None:
+            total = (await db.execute(_log_count_stmt([*filters, Log.id <= high_water]))).scalar() or 0
+            log_count_cache.put(key, total, high_water)
+            return total
+        total, seen = cached
+        if seen < high_water:
+            total += (await db.execute(_log_count_stmt([*filters, Log.id > seen, Log.id <= high_water]))).scalar() or 0
+            log_count_cache.advance(key, total, high_water)
+        return total
+    return (await db.execute(_log_count_stmt(filters))).scalar() or 0
+
+
+async def get_logs_filtered(
+    db: AsyncSession,
+    *,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    code: Optional[str] = None,
+    user_name: Optional[str] = None,
+    action: Optional[CodeAction] = None,
+    offset: int = 0,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    count_mode: Optional[str] = None,
+) -> LogPage:
+    """
+    One page of logs, newest first. Pass the next_cursor / prev_cursor of a
+    previous page (with the same filters) to move through the log without
+    OFFSET; offset only applies when no cursor is given. count_mode defaults
+    to settings.LOG_COUNT_MODE. Missing dates leave that side of the range
+    open rather than being looked up.
+    """
+    count_mode = count_mode or settings.LOG_COUNT_MODE
+    filters = _log_filters(start_date, end_date, code, user_name, action)
+
+    total_count = await count_logs(db, filters, _log_count_key(start_date, end_date, code, user_name, action), count_mode)
+    rows = (await db.execute(_log_page_stmt(filters, cursor, offset, limit))).scalars().all()
+
+    return _log_page(total_count, rows, cursor, offset, limit, count_mode)
+
+
+async def export_logs(
+    db: AsyncSession,
+    *,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    code: Optional[str] = None,
+    user_name: Optional[str] = None,
+    action: Optional[CodeAction] = None,
+) -> AsyncIterator[list]:
+    """
+    All logs matching the get_logs_filtered filters, as chunks of
+    LOG_EXPORT_COLUMNS tuples; only one chunk is held in memory at a time.
+    """
+    result = await db.stream(_log_export_stmt(_log_filters(start_date, end_date, code, user_name, action)))
+    async for chunk in result.partitions():
+        yield chunk
+
+
+async def delete_code(db: AsyncSession,
+                      code: str,
+                      user_name: str,
+                      contact_email: str):
+    code_obj = (await db.execute(
+        select(Code).where(Code.code == code, Code.status == CodeStatus.CAN_BE_USED.value)
+    )).scalars().first()
+
+    if not code_obj:
+        raise NoCodesAvailableError("Code not found or cannot be deleted")
+
+    await db.delete(code_obj)
+
+    db.add(log_table()(
+        code=code_obj.code,
+        user_name=user_name,
+        contact_email=contact_email,
+        tester_name=None,
+        action=CodeAction.DELETED.value,
+        note="Deleted",
+        logged_at=datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
+    ))
+
+
+async def get_all_countries(db: AsyncSession):
+    return (await db.execute(select(Country.id, Country.name))).all()
+
+
+async def get_usage_stats(
+    db: AsyncSession,
+    start: datetime,
+    end: datetime,
+    group_by: list[str],
+    filters: Dict[str, str],
+) -> Tuple[Optional[datetime], list]:
+    """
+    Log counts for [start, end) at hour resolution (both ends are rounded
+    down to the hour), grouped by group_by (see USAGE_TIME_BUCKETS and
+    USAGE_DIMENSIONS) and filtered by USAGE_DIMENSIONS values, where ''
+    stands for unknown. Returns the rollup watermark and the rows.
+    """
+    watermark = (await db.execute(
+        select(RollupWatermark.upto).where(RollupWatermark.name == USAGE_ROLLUP)
+    )).scalar()
+    stmt = _usage_stats_stmt(watermark, usage_hour(start), usage_hour(end), group_by, filters)
+    return watermark, (await db.execute(stmt)).all()
@@ -1,297 +1,325 @@
 from __future__ import annotations
-from typing import Iterable, Dict, List, Tuple
-from sqlalchemy import false,or_
-from sqlalchemy.orm import selectinload
+from typing import Iterable, Dict, List, NamedTuple, Tuple
+import base64
+import json
+import re
+import logging
+from sqlalchemy import or_, and_, cast, column, delete, literal, table, text, tuple_, union_all, BigInteger, String
 from zoneinfo import ZoneInfo
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy import select
-from app.core.exceptions import (NoCodesAvailableError,
-                                 UserNotFound,
-                                 UserHasReservedCodesError)
 from sqlalchemy import  func
-from datetime import datetime
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from app.db.models import Code, Log, User, CodeStatus, CodeAction, CodeType, Region,Country
+from app.db.models import (Code, Log, LogUserName, User, CodeStatus, CodeAction, CodeType, Country, PoolCounter,
+                           RollupWatermark, UsageRollup, code_countries)
+from app.db.log_outbox import log_table
+from app.db.ddl import log_search
+from app.config import settings
 from typing import Optional
 
-
-def get_code_count(db: Session):
-    """
-        Compute counts grouped by status and map into a Pydantic model.
-        """
-    rows = (
-        db.query(Code.status, func.count(Code.code))
-        .group_by(Code.status)
-        .all()
-    )
-    if not rows:
-        raise NoCodesAvailableError()
-    by_status = {
-        (s.value if hasattr(s, "value") else s): n
-        for s, n in rows
-    }
-
-    return by_status
-
-def create_user(db: Session,
-                team_name: str,
-                user_name: str,
-                contact_email: str,
-                password: str,
-                is_admin: bool
-                ):
-    now = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
-    new_user=User(team_name=team_name,
-                  user_name=user_name,
-                  contact_email=contact_email,
-                  password_hash=password,
-                  is_admin=is_admin,
-                  created_at=now
-                  )
-    db.add(new_user)
-    return new_user
+logger = logging.getLogger(__name__)
 
 
-
-def fetch_users_with_reserved_codes(
-    db: Session,
-    *,
-    only_user_id: Optional[int] = None,
-) -> List[User]:
-
-    q = (
-        db.query(User)
-        .options(
-
-            selectinload(User.codes.and_(Code.status == CodeStatus.RESERVED))
-        )
+def _code_count_stmt(code_type: Optional[str], country: Optional[str]):
+    stmt = (
+        select(PoolCounter.status, func.sum(PoolCounter.n))
+        .group_by(PoolCounter.status)
+        .having(func.sum(PoolCounter.n) > 0)
     )
-
-    if only_user_id is not None:
-        q = q.filter(
-            or_(
-                User.id == only_user_id,
-                User.is_admin == false()
-            )
-        )
+    if country:
+        stmt = stmt.join(Country, Country.id == PoolCounter.country_id).where(Country.name == country)
     else:
-        q = q.filter(User.is_admin == false())
-
-    return q.all()
-
-
-def update_user(
-        db: Session,
-        id: int,
-        team_name: str,
-        user_name: str,
-        contact_email: str,
-        password: str,
-        is_admin: bool
-):
-    user=db.query(User).filter(User.id==id).first()
-
-    if not user:
-        raise UserNotFound(f"User with id:{id} is not present in the database")
-
-    updates = {
-        "team_name": team_name,
-        "user_name": user_name,
-        "contact_email": contact_email,
-        "password": password,
-        "is_admin": is_admin,
-    }
-
-    for field, value in updates.items():
-        if value is not None:
-            setattr(user, field, value)
-    user.created_at = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
-    return user
-
-
+        stmt = stmt.where(PoolCounter.country_id == 0)
+    if code_type:
+        stmt = stmt.where(PoolCounter.code_type == CodeType(code_type).value)
+    return stmt
 
-def delete_user(db: Session, user_id: int):
 
-    result = (
-        db.query(
-            User,
-            func.count(Code.code).filter(Code.status == CodeStatus.RESERVED.value).label("reserved_count")
-        )
-        .outerjoin(Code, Code.user_id == User.id)
-        .filter(User.id == user_id)
-        .group_by(User.id)
-        .first()
+def _pool_counter_drift(keys: Optional[List[Tuple[str, str, int]]] = None):
+    """
+    (code_type, status, country_id, actual, counted) for every key whose
+    counter is off, or only for the given (code_type, status, country_id) keys.
+    """
+    code_type = cast(Code.code_type, String).label("code_type")
+    status = cast(Code.status, String).label("status")
+    totals = (
+        select(code_type, status, literal(0, BigInteger).label("country_id"), func.count().label("n"))
+        .group_by(Code.code_type, Code.status)
+    )
+    by_country = (
+        select(code_type, status, code_countries.c.country_id, func.count().label("n"))
+        .join(code_countries, code_countries.c.code == Code.code)
+        .group_by(Code.code_type, Code.status, code_countries.c.country_id)
     )
+    counted = (
+        select(PoolCounter.code_type, PoolCounter.status, PoolCounter.country_id, func.sum(PoolCounter.n).label("n"))
+        .group_by(PoolCounter.code_type, PoolCounter.status, PoolCounter.country_id)
+    )
+    if keys is not None:
+        pools = tuple_(Code.code_type, Code.status).in_({(CodeType(t), CodeStatus(s)) for t, s, _ in keys})
+        totals = totals.where(pools)
+        by_country = by_country.where(pools, code_countries.c.country_id.in_({c for _, _, c in keys if c}))
+        counted = counted.where(tuple_(PoolCounter.code_type, PoolCounter.status, PoolCounter.country_id).in_(keys))
+    actual = union_all(totals, by_country).subquery("actual")
+    counted = counted.subquery("counted")
+    actual_n = func.coalesce(actual.c.n, 0)
+    counted_n = func.coalesce(counted.c.n, 0)
+    key = (
+        func.coalesce(actual.c.code_type, counted.c.code_type).label("code_type"),
+        func.coalesce(actual.c.status, counted.c.status).label("status"),
+        func.coalesce(actual.c.country_id, counted.c.country_id).label("country_id"),
+    )
+    stmt = (
+        select(*key, actual_n.label("actual"), counted_n.label("counted"))
+        .select_from(actual.join(
+            counted,
+            and_(
+                counted.c.code_type == actual.c.code_type,
+                counted.c.status == actual.c.status,
+                counted.c.country_id == actual.c.country_id,
+            ),
+            full=True,
+        ))
+        .where(actual_n != counted_n)
+    )
+    # The filtered pools count other countries' codes too; keep the asked-for keys
+    return stmt if keys is None else stmt.where(tuple_(*key).in_(keys))
 
-    if not result:
-        raise UserNotFound
 
-    user, reserved_count = result
+def reconcile_pool_counters(db: Session) -> int:
+    """
+    Compare pool_counters with a full count of codes and rewrite the keys that
+    drifted (or were never counted, e.g. codes loaded before the triggers
+    existed). The full count runs unlocked; only the keys it found off are
+    then recounted and rewritten with pool_counters locked against writers,
+    so no in-flight delta can land between that recount and the rewrite.
+    Returns the number of keys repaired.
+    """
+    drift = db.execute(_pool_counter_drift()).all()
+    if not drift:
+        return 0
+
+    # Writers queue behind this lock; give up rather than stall them for long
+    db.execute(text("SET LOCAL lock_timeout = '2s'"))
+    db.execute(text("LOCK TABLE pool_counters IN EXCLUSIVE MODE"))
+    drift = db.execute(_pool_counter_drift([(r.code_type, r.status, r.country_id) for r in drift])).all()
+    if not drift:
+        return 0
+
+    keys = [(r.code_type, r.status, r.country_id) for r in drift]
+    db.execute(
+        delete(PoolCounter)
+        .where(tuple_(PoolCounter.code_type, PoolCounter.status, PoolCounter.country_id).in_(keys))
+    )
+    rows = [
+        {"code_type": r.code_type, "status": r.status, "country_id": r.country_id, "slot": 0, "n": r.actual}
+        for r in drift if r.actual
+    ]
+    if rows:
+        db.execute(insert(PoolCounter).values(rows))
 
-    if reserved_count > 0:
-        raise UserHasReservedCodesError (f"Action denied: user has reserved {reserved_count} code(s).")
-    db.delete(user)
+    for r in drift:
+        logger.warning("pool counter drift %s/%s/%s: counted %s, actual %s",
+                       r.code_type, r.status, r.country_id, r.counted, r.actual)
+    return len(drift)
 
+def _bulk_create_users_stmt(users: list[dict]):
+    now = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
+    return (
+        insert(User)
+        .values([{**u, "created_at": now} for u in users])
+        .on_conflict_do_nothing(index_elements=[User.contact_email])
+        .returning(User.id, User.team_name, User.user_name, User.contact_email, User.is_admin)
+    )
 
-def bulk_add_codes(
-    db: Session,
-    *,
-    code_type: str,
-    countries: Iterable[str] | None,   # <-- multiple countries supported
-    codes: Iterable[str],
-    user_name: str,
-    contact_email: str,
-) -> Dict:
-    """
-    Insert codes and associate each with zero or more countries.
-    Returns:
-      {
-        "inserted": [code, ...],               # actually inserted into codes table
-        "failed": [(code, reason), ...],       # validation or duplicate reasons
-        "unknown_countries": ["X", ...],       # country names not found in DB
-        "attached": {(code, country_name), ...}# associations created
-      }
-      - If a country name is unknown, code is still inserted, just no association for that name.
-    """
 
-    def validate_code(code: str) -> bool:
+# Session-local staging table for code ingestion; COPY fills it one chunk at a time
+CODE_INGEST_TABLE = "code_ingest"
+_code_ingest = table(CODE_INGEST_TABLE, column("code", String))
+_CODE_INGEST_DDL = f"CREATE TEMP TABLE IF NOT EXISTS {CODE_INGEST_TABLE} (code varchar(64)) ON COMMIT DROP"
+_CODE_INGEST_COPY = f"COPY {CODE_INGEST_TABLE} (code) FROM STDIN"
 
-        return bool(code and code.strip())
 
+def _check_code_type(code_type: str) -> CodeType:
     allowed_types = {CodeType.OSV.value, CodeType.HSV.value, CodeType.COMMON.value}
     if code_type not in allowed_types:
         raise ValueError(f"Invalid code_type '{code_type}'. Allowed: {sorted(allowed_types)}")
+    return CodeType(code_type)
 
-    result: Dict = {
-        "inserted": [],
-        "failed": [],
-        "unknown_countries": [],
-        "attached": set(),
-    }
+
+def _record_failed(result: Dict, failed: Iterable[Tuple[str, str]]) -> None:
+    """Count rejected codes, keeping the first CODE_INGEST_MAX_FAILED of them as (code, reason)."""
+    for entry in failed:
+        result["failed_count"] += 1
+        if len(result["failed"]) < settings.CODE_INGEST_MAX_FAILED:
+            result["failed"].append(entry)
 
 
-    seen: set[str] = set()
-    normalized: List[str] = []
-    for raw in (codes or []):
+def _normalize_codes(codes: Iterable[str], result: Dict, pattern: Optional[re.Pattern] = None) -> List[str]:
+    """
+    Upper-cased, de-duplicated codes of one chunk; blanks, codes not matching
+    pattern and repeats within the chunk are recorded as failed. Repeats
+    across chunks are left to the ON CONFLICT in _ingest_stmt.
+    """
+    normalized: Dict[str, None] = {}
+    failed: List[Tuple[str, str]] = []
+    for raw in codes:
         code = (raw or "").strip().upper()
         if not code:
-            result["failed"].append((raw, "empty_or_blank"))
-            continue
-        if not validate_code(code):
-            result["failed"].append((code, "invalid_format"))
-            continue
-        if code in seen:
-            result["failed"].append((code, "duplicate_in_batch"))
-            continue
-        seen.add(code)
-        normalized.append(code)
-
-    if not normalized:
-        raise ValueError("No valid codes to insert.")
-
+            failed.append((raw, "empty_or_blank"))
+        elif pattern is not None and not pattern.match(code):
+            failed.append((raw.strip(), "invalid_format"))
+        elif code in normalized:
+            failed.append((code, "duplicate_in_batch"))
+        else:
+            normalized[code] = None
+    _record_failed(result, failed)
+    return list(normalized)
+
+
+def _copy_payload(codes: List[str]) -> str:
+    """COPY text format, one code per line."""
+    return "".join(
+        code.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r") + "\n"
+        for code in codes
+    )
 
-    rows = [
-        {
-            "code": code,
-            "user_id": None,
-            "tester_name": None,
-            "requested_at": None,
-            "released_at": None,
-            "reservation_token": None,
-            "status": CodeStatus.CAN_BE_USED,
-            "note": None,
-            "code_type": CodeType(code_type),
-        }
-        for code in normalized
-    ]
 
-    stmt = (
+def _ingest_stmt(code_type: CodeType, country_ids: List[int], user_name: str, contact_email: str,
+                 note: str, now: datetime):
+    """
+    Move the staged chunk into codes (skipping codes that already exist),
+    link the new codes to country_ids and log them as ADDED, as one
+    statement; selects the codes actually inserted.
+    """
+    inserted = (
         insert(Code)
-        .values(rows)
+        .from_select(
+            ["code", "code_type", "status"],
+            select(
+                _code_ingest.c.code,
+                literal(code_type, Code.code_type.type),
+                literal(CodeStatus.CAN_BE_USED, Code.status.type),
+            ),
+        )
         .on_conflict_do_nothing(index_elements=[Code.code])
         .returning(Code.code)
+        .cte("inserted")
     )
-    inserted_rows = db.execute(stmt).fetchall()
-    inserted_codes = [r[0] for r in inserted_rows]
-    result["inserted"] = inserted_codes
-
+    logged = insert(log_table()).from_select(
+        ["code", "user_name", "contact_email", "action", "note", "logged_at"],
+        select(
+            inserted.c.code,
+            literal(user_name),
+            literal(contact_email),
+            literal(CodeAction.ADDED, Log.action.type),
+            literal(note),
+            literal(now),
+        ),
+    )
+    stmt = select(inserted.c.code).add_cte(logged.cte("logged"))
+    if country_ids:
+        linked = insert(code_countries).from_select(
+            ["code", "country_id"],
+            select(inserted.c.code, Country.id).select_from(inserted).join(Country, Country.id.in_(country_ids)),
+        ).on_conflict_do_nothing()
+        stmt = stmt.add_cte(linked.cte("linked"))
+    return stmt
+
+
+def _resolve_countries(found: Iterable[Tuple[str, int]], names: List[str]) -> Tuple[Dict[str, int], List[str]]:
+    country_map = {name: country_id for name, country_id in found}
+    return country_map, sorted(set(names) - set(country_map))
+
+
+def _chunked(codes: Iterable[str], size: int) -> Iterable[List[str]]:
+    chunk: List[str] = []
+    for code in codes:
+        chunk.append(code)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bulk_add_result(result: Dict, inserted_codes: List[str], country_names: Iterable[str]) -> Dict:
+    """bulk_add_codes' result, listing the inserted codes and their (code, country) links."""
+    return {
+        "inserted": inserted_codes,
+        "failed": result["failed"],
+        "failed_count": result["failed_count"],
+        "unknown_countries": result["unknown_countries"],
+        "attached": {(code, name) for code in inserted_codes for name in country_names},
+    }
 
-    failed_insert = set(normalized) - set(inserted_codes)
-    for code in failed_insert:
-        result["failed"].append((code, "duplicate_in_db"))
+# Statuses listed by /admin/codes/all
+LISTED_CODE_STATUSES = (CodeStatus.RESERVED, CodeStatus.CAN_BE_USED)
 
 
-    country_name_list = [c.strip() for c in (countries or []) if c and c.strip()]
-    country_map: dict[str, Country] = {}
-    if country_name_list:
-        found = db.query(Country).filter(Country.name.in_(country_name_list)).all()
-        country_map = {c.name: c for c in found}
-        unknown = sorted(set(country_name_list) - set(country_map.keys()))
-        result["unknown_countries"].extend(unknown)
+def encode_codes_cursor(code_type: CodeType, status: CodeStatus, code: str) -> str:
+    raw = json.dumps([code_type.value, status.value, code])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
-    if inserted_codes and country_map:
-        code_objs = db.query(Code).filter(Code.code.in_(inserted_codes)).all()
-        for code_obj in code_objs:
 
-            existing = {c.id for c in code_obj.countries}
-            for name, country_obj in country_map.items():
-                if country_obj.id not in existing:
-                    code_obj.countries.append(country_obj)
-                    result["attached"].add((code_obj.code, name))
+def decode_codes_cursor(cursor: str) -> Tuple[CodeType, CodeStatus, str]:
+    """(code_type, status, code) of the last code on the previous page; ValueError if it is not one of ours."""
+    try:
+        code_type, status, code = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return CodeType(code_type), CodeStatus(status), str(code)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
 
 
-    now = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
-    for code in inserted_codes:
-        db.add(Log(
-            code=code,
-            user_id=None,
-            user_name=user_name,
-            contact_email=contact_email,
-            tester_name=None,
-            action=CodeAction.ADDED,   # pass Enum
-            note=f"Code added for {code_type} / {', '.join(country_map.keys()) or 'ANY'}",
-            logged_at=now,
+def _codes_listing_stmt(
+    code_type: Optional[CodeType] = None,
+    status: Optional[CodeStatus] = None,
+    country: Optional[str] = None,
+    cursor: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """
+    (code_type, status, code) rows in (code_type, status, code) order, which
+    idx_codes_type_status_code hands back without a sort; a cursor continues
+    after the code it names and until stops at (and includes) the code it names.
+    """
+    stmt = select(Code.code_type, Code.status, Code.code).where(
+        Code.status == status if status else Code.status.in_(LISTED_CODE_STATUSES)
+    )
+    if code_type:
+        stmt = stmt.where(Code.code_type == code_type)
+    if country:
+        stmt = stmt.where(Code.code.in_(
+            select(code_countries.c.code)
+            .join(Country, Country.id == code_countries.c.country_id)
+            .where(Country.name == country)
         ))
+    if cursor:
+        stmt = stmt.where(tuple_(Code.code_type, Code.status, Code.code) > _codes_cursor_row(cursor))
+    if until:
+        stmt = stmt.where(tuple_(Code.code_type, Code.status, Code.code) <= _codes_cursor_row(until))
+    return stmt.order_by(Code.code_type, Code.status, Code.code)
 
-    return result
 
-def get_codes_grouped(db: Session):
+def _codes_cursor_row(cursor: str):
+    code_type, status, code = decode_codes_cursor(cursor)
+    return tuple_(literal(code_type, Code.code_type.type), literal(status, Code.status.type), literal(code))
 
-    stmt = (
-        select(Code)
-        .where(Code.status.in_([CodeStatus.RESERVED.value, CodeStatus.CAN_BE_USED.value]))
-    )
-    rows = db.execute(stmt).scalars().all()
 
-    return rows
+def _codes_next_cursor_stmt(limit: int, **filters):
+    """The page's last row and the one after it; a cursor is only due when both exist."""
+    return _codes_listing_stmt(**filters).offset(limit - 1).limit(2)
+
 
 PAGE_SIZE = 20
 
-def get_log_date_bounds(db: Session) -> Tuple[Optional[datetime], Optional[datetime]]:
-    """Return the oldest and newest logged_at timestamps in the logs table."""
-    min_date = db.query(func.min(Log.logged_at)).scalar()
-    max_date = db.query(func.max(Log.logged_at)).scalar()
-    return min_date, max_date
-
-def get_logs_filtered(
-    db: Session,
-    *,
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-    code: Optional[str] = None,
-    user_name: Optional[str] = None,
-    action: Optional[CodeAction] = None,
-    offset: int = 0,
-    limit: int = 20,
-) -> Tuple[int, List[Log]]:
-
-    if start_date is None or end_date is None:
-        min_date, max_date = get_log_date_bounds(db)
-        if start_date is None:
-            start_date = min_date
-        if end_date is None:
-            end_date = max_date
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards (backslash is Postgres' default escape) so user input matches literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 
+def _log_filters(start_date, end_date, code, user_name, action) -> list:
     filters = []
     if start_date and end_date:
         filters.append(Log.logged_at.between(start_date, end_date))
@@ -299,64 +327,244 @@ def get_logs_filtered(
         filters.append(Log.logged_at >= start_date)
     elif end_date:
         filters.append(Log.logged_at <= end_date)
-
     if code:
+        # Prefix or suffix match; the suffix is a prefix match on reverse(code) so both sides
+        # are range scans on idx_logs_code_pattern / idx_logs_code_reverse
         filters.append(
             or_(
-                Log.code.like(f"{code}%"),
-                Log.code.like(f"%{code}")
+                Log.code.like(f"{_escape_like(code)}%"),
+                func.reverse(Log.code).like(f"{_escape_like(code[::-1])}%")
             )
         )
-
     if user_name:
-        filters.append(Log.user_name.ilike(f"%{user_name}%"))
-
+        pattern = f"%{_escape_like(user_name)}%"
+        if log_search.user_names_table:
+            filters.append(Log.user_name.in_(select(LogUserName.name).where(LogUserName.name.ilike(pattern))))
+        else:
+            filters.append(Log.user_name.ilike(pattern))
     if action:
         filters.append(Log.action == action.value)
+    return filters
+
+
+class LogPage(NamedTuple):
+    total_count: int
+    logs: List[Log]
+    # Opaque keyset cursors for the next (older) and previous (newer) page, None at either end
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+    # How total_count was arrived at: "exact", "estimated" or "cached"
+    count_mode: str = "exact"
+
+
+def _encode_log_cursor(log: Log, direction: str) -> str:
+    raw = json.dumps({"d": direction, "t": log.logged_at.isoformat(), "id": log.id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_log_cursor(cursor: str) -> Tuple[str, datetime, int]:
+    """(direction, logged_at, id) from a cursor; ValueError if it is not one of ours."""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        direction, logged_at, log_id = raw["d"], datetime.fromisoformat(raw["t"]), int(raw["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if direction not in ("next", "prev"):
+        raise ValueError("Invalid cursor")
+    return direction, logged_at, log_id
 
-    query = db.query(Log).filter(*filters)
 
-    total_count = query.with_entities(func.count()).scalar() or 0
+def _log_page_stmt(filters: list, cursor: Optional[str], offset: int, limit: int):
+    """
+    Newest-first page of logs, fetching one extra row to tell whether there
+    is more. With a cursor it seeks from that (logged_at, id) position; the
+    bare logged_at bound is what lets the logged_at index do the seeking,
+    the id comparison only breaks ties within a timestamp.
+    """
+    stmt = select(Log).where(*filters)
+    if cursor is None:
+        return stmt.order_by(Log.logged_at.desc(), Log.id.desc()).offset(offset).limit(limit + 1)
+
+    direction, logged_at, log_id = decode_log_cursor(cursor)
+    if direction == "next":
+        stmt = (
+            stmt.where(Log.logged_at <= logged_at, or_(Log.logged_at < logged_at, Log.id < log_id))
+            .order_by(Log.logged_at.desc(), Log.id.desc())
+        )
+    else:
+        stmt = (
+            stmt.where(Log.logged_at >= logged_at, or_(Log.logged_at > logged_at, Log.id > log_id))
+            .order_by(Log.logged_at.asc(), Log.id.asc())
+        )
+    return stmt.limit(limit + 1)
+
+
+LOG_COUNT_MODES = ("exact", "estimated", "cached")
+
+
+def _log_count_stmt(filters: list):
+    return select(func.count()).select_from(Log).where(*filters)
+
+
+def _log_estimate_sql(filters: list, dialect) -> Tuple[str, dict]:
+    """EXPLAIN for the filtered logs, to be run with exec_driver_sql; the top node's Plan Rows is the estimate."""
+    compiled = select(Log.id).where(*filters).compile(dialect=dialect)
+    return "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+
+
+def _plan_rows(plan) -> int:
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
 
-    logs = (
-        query.order_by(Log.logged_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
+
+def _log_count_key(start_date, end_date, code, user_name, action) -> tuple:
+    return start_date, end_date, code, user_name, getattr(action, "value", action)
+
+
+def _log_page(total_count: int, rows: list, cursor: Optional[str], offset: int, limit: int,
+              count_mode: str = "exact") -> LogPage:
+    more = len(rows) > limit
+    logs = list(rows[:limit])
+    backwards = cursor is not None and decode_log_cursor(cursor)[0] == "prev"
+    if backwards:
+        logs.reverse()
+    # Walking back from an older page there is always something older; walking forward there is
+    # something newer once we have left the first page
+    has_older = True if backwards else more
+    has_newer = more if backwards else (cursor is not None or offset > 0)
+    return LogPage(
+        total_count=total_count,
+        logs=logs,
+        next_cursor=_encode_log_cursor(logs[-1], "next") if logs and has_older else None,
+        prev_cursor=_encode_log_cursor(logs[0], "prev") if logs and has_newer else None,
+        count_mode=count_mode,
     )
 
-    return total_count, logs
 
+# Columns of a log export, in output order
+LOG_EXPORT_COLUMNS = ("id", "code", "action", "user_name", "contact_email", "tester_name",
+                      "region_name", "country_name", "note", "logged_at")
 
 
+def _log_export_stmt(filters: list):
+    """Plain rows (no ORM objects) of every matching log, in /admin/logs order, fetched through a server-side cursor."""
+    return (
+        select(*(Log.__table__.c[name] for name in LOG_EXPORT_COLUMNS))
+        .where(*filters)
+        .order_by(Log.logged_at.desc(), Log.id.desc())
+        .execution_options(yield_per=settings.LOG_EXPORT_CHUNK)
+    )
 
-def delete_code(db : Session,
-                code:str,
-                user_name:str,
-                contact_email:str):
-    code_obj = db.query(Code).filter(
-        (Code.code == code) &
-        (Code.status == CodeStatus.CAN_BE_USED.value)
-    ).first()
 
-    if not code_obj:
-        raise NoCodesAvailableError("Code not found or cannot be deleted")
+# ----------------------------
+# Usage rollups
+# ----------------------------
+
+USAGE_ROLLUP = "usage_rollups"
+USAGE_TZ = "Asia/Kolkata"
+# group_by values of get_usage_stats: at most one time bucket plus any of the dimensions
+USAGE_TIME_BUCKETS = ("hour", "day", "week", "month")
+USAGE_DIMENSIONS = {
+    "action": "action",
+    "region": "region_name",
+    "country": "country_name",
+    "code_type": "code_type",
+    "team": "team_name",
+}
+
+
+def usage_hour(dt: datetime) -> datetime:
+    """dt rounded down to the hour that usage_rollups buckets it in."""
+    return dt.astimezone(ZoneInfo(USAGE_TZ)).replace(minute=0, second=0, microsecond=0)
+
+
+def _usage_from_logs(start: datetime, end: datetime):
+    """usage_rollups-shaped hourly rows for [start, end), aggregated straight from logs."""
+    dims = (
+        func.date_trunc("hour", Log.logged_at, USAGE_TZ).label("bucket"),
+        Log.action.label("action"),
+        func.coalesce(Log.region_name, "").label("region_name"),
+        func.coalesce(Log.country_name, "").label("country_name"),
+        func.coalesce(cast(Code.code_type, String), "").label("code_type"),
+        func.coalesce(User.team_name, "").label("team_name"),
+    )
+    return (
+        select(*dims, func.count().label("n"))
+        .select_from(Log)
+        .outerjoin(Code, Code.code == Log.code)
+        .outerjoin(User, User.id == Log.user_id)
+        .where(Log.logged_at >= start, Log.logged_at < end)
+        .group_by(*dims)
+    )
 
 
-    db.delete(code_obj)
+def usage_watermark(db: Session) -> Optional[datetime]:
+    return db.execute(select(RollupWatermark.upto).where(RollupWatermark.name == USAGE_ROLLUP)).scalar()
 
 
-    db.add(Log(
-        code=code_obj.code,
-        user_name=user_name,
-        contact_email=contact_email,
-        tester_name=None,
-        action=CodeAction.DELETED.value,
-        note="Deleted",
-        logged_at=datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")  # pass datetime object, NOT string
-    ))
+def rollup_usage(db: Session) -> int:
+    """
+    Build usage_rollups for the whole hours between the watermark and the
+    last hour that closed at least USAGE_ROLLUP_SETTLE_SECONDS ago (at most
+    USAGE_ROLLUP_MAX_HOURS per run, so a first run over a long history is
+    spread out), then move the watermark. Hours are rebuilt rather than
+    added to, so a rerun never double counts. Returns the rollup rows written.
+    """
+    start = usage_watermark(db)
+    if start is None:
+        first = db.execute(select(func.min(Log.logged_at))).scalar()
+        start = usage_hour(first) if first else None
+    end = usage_hour(datetime.now(ZoneInfo(USAGE_TZ)) - timedelta(seconds=settings.USAGE_ROLLUP_SETTLE_SECONDS))
+    if start is not None:
+        end = min(end, start + timedelta(hours=settings.USAGE_ROLLUP_MAX_HOURS))
+    if start is not None and end <= start:
+        return 0
+
+    written = 0
+    if start is not None:
+        db.execute(delete(UsageRollup).where(UsageRollup.bucket >= start, UsageRollup.bucket < end))
+        source = _usage_from_logs(start, end)
+        written = db.execute(
+            insert(UsageRollup).from_select([c.name for c in source.selected_columns], source)
+        ).rowcount
+    db.execute(
+        insert(RollupWatermark)
+        .values(name=USAGE_ROLLUP, upto=end)
+        .on_conflict_do_update(index_elements=[RollupWatermark.name], set_={"upto": end})
+    )
+    return written
+
 
-def get_all_countries(db: Session):
-    stmt = select(Country.id, Country.name)
-    result = db.execute(stmt).all()
-    return result
\ No newline at end of file
+def _usage_stats_stmt(watermark: Optional[datetime], start: datetime, end: datetime,
+                      group_by: list[str], filters: Dict[str, str]):
+    """
+    Counts over [start, end) grouped by group_by: usage_rollups up to the
+    watermark, and logs themselves for the (at most a few hours) after it.
+    """
+    parts = []
+    split = min(max(watermark, start), end) if watermark else start
+    if split > start:
+        parts.append(select(
+            UsageRollup.bucket, UsageRollup.action, UsageRollup.region_name, UsageRollup.country_name,
+            UsageRollup.code_type, UsageRollup.team_name, UsageRollup.n,
+        ).where(UsageRollup.bucket >= start, UsageRollup.bucket < split))
+    if end > split:
+        parts.append(_usage_from_logs(split, end))
+    rows = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery("usage")
+
+    columns = []
+    for group in group_by:
+        if group == "hour":
+            columns.append(rows.c.bucket)
+        elif group in USAGE_TIME_BUCKETS:
+            columns.append(func.date_trunc(group, rows.c.bucket, USAGE_TZ).label("bucket"))
+        else:
+            columns.append(rows.c[USAGE_DIMENSIONS[group]].label(group))
+    conditions = [rows.c[USAGE_DIMENSIONS[name]] == value for name, value in filters.items()]
+    return (
+        select(*columns, func.coalesce(func.sum(rows.c.n), 0).label("count"))
+        .where(*conditions)
+        .group_by(*columns)
+        .order_by(*columns)
+    )
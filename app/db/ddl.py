@@ -0,0 +1,431 @@
+import logging
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+from app.config import settings
+from app.db.models import Code, Log
+
+logger = logging.getLogger(__name__)
+
+# Serialises schema changes made at startup when several workers boot together
+SCHEMA_DDL_LOCK_KEY = 7_240_101
+
+
+@contextmanager
+def _ddl_connection(engine: Engine):
+    """
+    Autocommit connection holding the schema advisory lock, for DDL that
+    can't run inside a transaction block (CREATE INDEX CONCURRENTLY).
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_DDL_LOCK_KEY})
+        try:
+            yield conn
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_DDL_LOCK_KEY})
+
+
+def _create_index_concurrently(conn, ddl: str, name: str, table: str):
+    """
+    Run a CREATE INDEX IF NOT EXISTS statement CONCURRENTLY where Postgres
+    allows it. A partitioned table doesn't, so there the index is built in
+    one locking pass over the partitions.
+    """
+    valid = conn.execute(text("""
+        SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name
+    """), {"name": name}).scalar()
+    if valid:
+        return
+    partitioned = conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"),
+                               {"table": table}).scalar()
+    if partitioned:
+        conn.execute(text(ddl))
+        return
+    if valid is False:
+        # An interrupted concurrent build leaves an INVALID index that IF NOT EXISTS would keep forever
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)))
+
+
+# Indexes added after the tables were first created; create_all() only
+# builds indexes together with a brand new table.
+LATE_INDEXES = (
+    (Code, "idx_codes_pool_head"),
+    (Code, "idx_codes_type_status_code"),
+    (Log, "idx_logs_code_pattern"),
+    (Log, "idx_logs_code_reverse"),
+    (Log, "idx_logs_user_name"),
+)
+
+
+def ensure_indexes(engine: Engine):
+    """
+    Build any missing LATE_INDEXES, CONCURRENTLY where the table allows it
+    so a large table keeps taking writes meanwhile.
+    """
+    with _ddl_connection(engine) as conn:
+        for model, name in LATE_INDEXES:
+            index = next(i for i in model.__table__.indexes if i.name == name)
+            _create_index_concurrently(conn, str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect)),
+                                       name, model.__tablename__)
+
+
+# ----------------------------
+# Log partitions
+# ----------------------------
+
+# Held while log partitions are created, retired or migrated, at startup and by the maintenance job
+LOG_PARTITION_LOCK_KEY = 7_240_004
+LOG_PARTITION_TZ = ZoneInfo("Asia/Kolkata")
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def _month_start(dt: datetime) -> datetime:
+    return dt.astimezone(LOG_PARTITION_TZ).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month = dt.month - 1 + months
+    return dt.replace(year=dt.year + month // 12, month=month % 12 + 1)
+
+
+def _parse_bound(value: str) -> datetime | None:
+    """A range partition bound as written by pg_get_expr; None for MINVALUE / MAXVALUE."""
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def _log_partitions(conn) -> list[tuple[str, datetime | None, datetime | None]]:
+    """(name, from, to) of every range partition of logs; the default partition is left out."""
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass
+    """)).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound)
+        if match:
+            partitions.append((name, _parse_bound(match[1]), _parse_bound(match[2])))
+    return partitions
+
+
+def _create_log_partition(conn, start: datetime, end: datetime) -> str:
+    name = f"logs_{start:%Y_%m}"
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    params = {"start": start, "end": end}
+    stray = conn.execute(text(
+        "SELECT 1 FROM logs_default WHERE logged_at >= :start AND logged_at < :end LIMIT 1"
+    ), params).scalar()
+    if stray:
+        # Rows of this month already in the default partition would make the new range overlap; move them first
+        conn.execute(text(f"CREATE TABLE {name} (LIKE logs INCLUDING DEFAULTS)"))
+        conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM logs_default WHERE logged_at >= :start AND logged_at < :end RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), params)
+        conn.execute(text(f"ALTER TABLE logs ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    else:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF logs FOR VALUES {bounds}"))
+    return name
+
+
+def manage_log_partitions(conn, now: datetime | None = None) -> int:
+    """
+    Make sure logs has its default partition and monthly partitions from
+    this month to LOG_PARTITIONS_AHEAD months ahead, then detach or drop
+    (LOG_RETENTION_ACTION) partitions that ended more than
+    LOG_RETENTION_MONTHS months ago, which is a catalog-only change. Returns
+    the number of partitions created or retired.
+    """
+    conn.execute(text("CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT"))
+    partitions = _log_partitions(conn)
+    this_month = _month_start(now or datetime.now(LOG_PARTITION_TZ))
+    changed = 0
+
+    for i in range(settings.LOG_PARTITIONS_AHEAD + 1):
+        start, end = _add_months(this_month, i), _add_months(this_month, i + 1)
+        if any((lo is None or lo < end) and (hi is None or start < hi) for _, lo, hi in partitions):
+            continue
+        logger.info("created log partition %s", _create_log_partition(conn, start, end))
+        changed += 1
+
+    if settings.LOG_RETENTION_MONTHS > 0:
+        cutoff = _add_months(this_month, -settings.LOG_RETENTION_MONTHS)
+        for name, _, hi in partitions:
+            if hi is None or hi > cutoff:
+                continue
+            if settings.LOG_RETENTION_ACTION == "drop":
+                conn.execute(text(f"DROP TABLE {name}"))
+            else:
+                conn.execute(text(f"ALTER TABLE logs DETACH PARTITION {name}"))
+            logger.info("retired log partition %s (%s)", name, settings.LOG_RETENTION_ACTION)
+            changed += 1
+    return changed
+
+
+def _partition_legacy_logs(conn):
+    """
+    Turn a plain logs table into the partitioned one without copying rows:
+    the old table is attached as logs_legacy, covering everything before the
+    end of the current month (or of its newest row), and is retired by the
+    retention setting like any other partition once that has passed.
+    """
+    conn.execute(text("LOCK TABLE logs IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text("ALTER TABLE logs RENAME TO logs_legacy"))
+    conn.execute(text("ALTER SEQUENCE IF EXISTS logs_id_seq RENAME TO logs_legacy_id_seq"))
+    # Index names are schema-wide and the new parent reuses them
+    for (name,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'logs_legacy'")).all():
+        conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{(name + "_legacy")[:63]}"'))
+    # A partition must carry the parent's (id, logged_at) key; this is the one step that reads every row
+    pkey = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'logs_legacy'::regclass AND contype = 'p'"
+    )).scalar()
+    if pkey:
+        conn.execute(text(f'ALTER TABLE logs_legacy DROP CONSTRAINT "{pkey}"'))
+    conn.execute(text("ALTER TABLE logs_legacy ADD PRIMARY KEY (id, logged_at)"))
+    # Statement triggers belong on the parent; ensure_log_search puts it back there
+    conn.execute(text("DROP TRIGGER IF EXISTS log_user_names_insert ON logs_legacy"))
+
+    Log.__table__.create(bind=conn, checkfirst=True)
+    conn.execute(text("SELECT setval('logs_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM logs_legacy), false)"))
+
+    newest = conn.execute(text("SELECT max(logged_at) FROM logs_legacy")).scalar()
+    now = datetime.now(LOG_PARTITION_TZ)
+    end = _add_months(_month_start(max(newest, now) if newest else now), 1)
+    conn.execute(text(f"ALTER TABLE logs ATTACH PARTITION logs_legacy FOR VALUES FROM (MINVALUE) TO ('{end.isoformat()}')"))
+    logger.info("partitioned logs; existing rows are in logs_legacy up to %s", end)
+
+
+def ensure_log_partitions(engine: Engine):
+    """
+    Partition a logs table created before partitioning (see
+    _partition_legacy_logs) and create the partitions needed right now.
+    Runs at startup, ahead of anything that writes logs.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOG_PARTITION_LOCK_KEY})
+        if conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')")).scalar() == "r":
+            _partition_legacy_logs(conn)
+        manage_log_partitions(conn)
+
+
+# ----------------------------
+# Log search
+# ----------------------------
+
+class LogSearch:
+    """How user_name substring search is served; set by ensure_log_search, read by the crud filters."""
+    # False: plain ILIKE, which a pg_trgm GIN index serves (or a scan before ensure_log_search ran).
+    # True: ILIKE over log_user_names, then an IN lookup through idx_logs_user_name
+    user_names_table = False
+
+
+log_search = LogSearch()
+
+LOG_USER_NAME_TRGM_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_logs_user_name_trgm ON logs USING gin (user_name gin_trgm_ops)
+"""
+
+LOG_USER_NAMES_DDL = (
+    """
+    CREATE OR REPLACE FUNCTION log_user_names_insert() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO log_user_names (name)
+        SELECT DISTINCT user_name FROM new_logs WHERE user_name IS NOT NULL
+        ORDER BY 1
+        ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE TRIGGER log_user_names_insert
+    AFTER INSERT ON logs REFERENCING NEW TABLE AS new_logs
+    FOR EACH STATEMENT EXECUTE FUNCTION log_user_names_insert()
+    """,
+)
+
+
+def ensure_log_search(engine: Engine):
+    """
+    Set up indexed user_name search. With pg_trgm (installed here if the
+    role may) a trigram GIN index serves ILIKE '%name%' directly. Without
+    it, log_user_names is kept by a trigger on logs and backfilled the
+    first time the trigger is installed.
+    """
+    with _ddl_connection(engine) as conn:
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except DBAPIError as e:
+            logger.info("pg_trgm unavailable, user_name search goes through log_user_names: %s", e.orig)
+        trigram = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar() is not None
+
+        if trigram:
+            _create_index_concurrently(conn, LOG_USER_NAME_TRGM_INDEX, "idx_logs_user_name_trgm", "logs")
+            conn.execute(text("DROP TRIGGER IF EXISTS log_user_names_insert ON logs"))
+        else:
+            # conn autocommits; the trigger and its backfill need one transaction
+            with engine.begin() as tx:
+                installed = tx.execute(text(
+                    "SELECT 1 FROM pg_trigger WHERE tgname = 'log_user_names_insert' AND tgrelid = 'logs'::regclass"
+                )).scalar()
+                for ddl in LOG_USER_NAMES_DDL:
+                    tx.execute(text(ddl))
+                if not installed:
+                    # The trigger's lock keeps inserts out until this commits, so nothing slips between
+                    tx.execute(text("""
+                        INSERT INTO log_user_names (name)
+                        SELECT DISTINCT user_name FROM logs WHERE user_name IS NOT NULL
+                        ON CONFLICT DO NOTHING
+                    """))
+
+    log_search.user_names_table = not trigram
+
+
+# ----------------------------
+# Pool counters
+# ----------------------------
+
+# Slot rows per counter key. A transaction always writes the slot picked from
+# its txid, and each statement touches its keys in sorted order, so
+# concurrent writers spread out without deadlocking on one another.
+POOL_COUNTER_SLOTS = 16
+POOL_COUNTER_DDL_LOCK_KEY = 7_240_100
+
+_COUNTER_UPSERT = f"""
+    INSERT INTO pool_counters (code_type, status, country_id, slot, n)
+    SELECT code_type, status, country_id, (txid_current() % {POOL_COUNTER_SLOTS})::smallint, sum(d)
+    FROM deltas
+    GROUP BY code_type, status, country_id
+    HAVING sum(d) <> 0
+    ORDER BY code_type, status, country_id
+    ON CONFLICT (code_type, status, country_id, slot) DO UPDATE SET n = pool_counters.n + EXCLUDED.n
+"""
+
+POOL_COUNTER_DDL = (
+    # New codes have no countries yet; code_countries rows are counted as they arrive
+    f"""
+    CREATE OR REPLACE FUNCTION pool_counters_codes_insert() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        WITH deltas AS (
+            SELECT code_type::text AS code_type, status::text AS status, 0::bigint AS country_id, 1 AS d
+            FROM new_codes
+        )
+        {_COUNTER_UPSERT};
+        RETURN NULL;
+    END $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION pool_counters_codes_update() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        WITH moved AS (
+            SELECT o.code, o.code_type::text AS code_type, o.status::text AS status, -1 AS d
+            FROM old_codes o JOIN new_codes n ON n.code = o.code
+            WHERE (o.code_type, o.status) IS DISTINCT FROM (n.code_type, n.status)
+            UNION ALL
+            SELECT n.code, n.code_type::text, n.status::text, 1
+            FROM old_codes o JOIN new_codes n ON n.code = o.code
+            WHERE (o.code_type, o.status) IS DISTINCT FROM (n.code_type, n.status)
+        ), deltas AS (
+            SELECT code_type, status, 0::bigint AS country_id, d FROM moved
+            UNION ALL
+            SELECT m.code_type, m.status, cc.country_id, m.d
+            FROM moved m JOIN code_countries cc ON cc.code = m.code
+        )
+        {_COUNTER_UPSERT};
+        RETURN NULL;
+    END $$
+    """,
+    # Row-level and BEFORE: the code_countries rows removed by the cascade are
+    # still visible here, and the code_countries trigger skips codes already gone
+    f"""
+    CREATE OR REPLACE FUNCTION pool_counters_codes_delete() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        WITH deltas AS (
+            SELECT OLD.code_type::text AS code_type, OLD.status::text AS status, 0::bigint AS country_id, -1 AS d
+            UNION ALL
+            SELECT OLD.code_type::text, OLD.status::text, cc.country_id, -1
+            FROM code_countries cc WHERE cc.code = OLD.code
+        )
+        {_COUNTER_UPSERT};
+        RETURN OLD;
+    END $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION pool_counters_countries_insert() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        WITH deltas AS (
+            SELECT c.code_type::text AS code_type, c.status::text AS status, cc.country_id, 1 AS d
+            FROM new_links cc JOIN codes c ON c.code = cc.code
+        )
+        {_COUNTER_UPSERT};
+        RETURN NULL;
+    END $$
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION pool_counters_countries_delete() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        WITH deltas AS (
+            SELECT c.code_type::text AS code_type, c.status::text AS status, cc.country_id, -1 AS d
+            FROM old_links cc JOIN codes c ON c.code = cc.code
+        )
+        {_COUNTER_UPSERT};
+        RETURN NULL;
+    END $$
+    """,
+    """
+    CREATE OR REPLACE TRIGGER pool_counters_codes_insert
+    AFTER INSERT ON codes REFERENCING NEW TABLE AS new_codes
+    FOR EACH STATEMENT EXECUTE FUNCTION pool_counters_codes_insert()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER pool_counters_codes_update
+    AFTER UPDATE ON codes REFERENCING OLD TABLE AS old_codes NEW TABLE AS new_codes
+    FOR EACH STATEMENT EXECUTE FUNCTION pool_counters_codes_update()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER pool_counters_codes_delete
+    BEFORE DELETE ON codes
+    FOR EACH ROW EXECUTE FUNCTION pool_counters_codes_delete()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER pool_counters_countries_insert
+    AFTER INSERT ON code_countries REFERENCING NEW TABLE AS new_links
+    FOR EACH STATEMENT EXECUTE FUNCTION pool_counters_countries_insert()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER pool_counters_countries_delete
+    AFTER DELETE ON code_countries REFERENCING OLD TABLE AS old_links
+    FOR EACH STATEMENT EXECUTE FUNCTION pool_counters_countries_delete()
+    """,
+)
+
+
+def ensure_pool_counter_triggers(engine: Engine):
+    """
+    (Re)install the triggers that keep pool_counters in step with codes and
+    code_countries. Counts that predate them are filled in by the reconcile
+    job (maintenance.reconcile_pool_counters), which runs at startup.
+    """
+    with engine.begin() as conn:
+        # Workers start together; CREATE OR REPLACE on the same function races otherwise
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": POOL_COUNTER_DDL_LOCK_KEY})
+        for ddl in POOL_COUNTER_DDL:
+            conn.execute(text(ddl))
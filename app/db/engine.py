@@ -1,12 +1,14 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
 # create engine from DATABASE_URL
 engine = create_engine(
     settings.DATABASE_URL,
-    pool_size=10,
-    max_overflow=5,
+    pool_size=settings.SYNC_DB_POOL_SIZE,
+    max_overflow=settings.SYNC_DB_MAX_OVERFLOW,
     pool_timeout=30,
     pool_recycle=1800,
     pool_pre_ping=True
@@ -14,3 +16,17 @@ engine = create_engine(
 
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True, expire_on_commit=False)
+
+
+# Same database through psycopg 3's native asyncio support, for async request handlers.
+# The sync engine above stays for background jobs, scripts and the reservation buffer.
+async_engine = create_async_engine(
+    make_url(settings.DATABASE_URL).set(drivername="postgresql+psycopg"),
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=1800,
+    pool_pre_ping=True
+)
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, insert, select
+
+from app.config import settings
+from app.db.engine import SessionLocal
+from app.db.models import Log, LogOutbox, User
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ("code", "user_id", "user_name", "contact_email", "tester_name", "action",
+            "region_name", "country_name", "note", "logged_at")
+
+
+def log_table():
+    """Where crud writes audit rows: log_outbox under LOG_WRITE_BEHIND, otherwise logs itself."""
+    return LogOutbox if settings.LOG_WRITE_BEHIND else Log
+
+
+def _drain_stmt(batch_size: int):
+    """
+    Move the oldest batch_size outbox rows into logs in one statement:
+    DELETE ... RETURNING feeding a multi-row INSERT, in outbox order.
+    """
+    picked = (
+        select(LogOutbox.id)
+        .order_by(LogOutbox.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    moved = (
+        delete(LogOutbox)
+        .where(LogOutbox.id.in_(picked.scalar_subquery()))
+        .returning(LogOutbox.id, *(LogOutbox.__table__.c[name] for name in _COLUMNS))
+        .cte("moved")
+    )
+    # The outbox has no foreign key; a user deleted since the row was written is logged as SET NULL would
+    user_id = select(User.id).where(User.id == moved.c.user_id).scalar_subquery()
+    source = select(*(user_id if name == "user_id" else moved.c[name] for name in _COLUMNS)).order_by(moved.c.id)
+    return insert(Log).from_select(list(_COLUMNS), source)
+
+
+class LogOutboxWriter:
+    """
+    Drains log_outbox into logs. Each batch is its own transaction, so a row
+    is moved exactly once even if the process dies mid-flush, and SKIP
+    LOCKED lets every worker drain at the same time. A flush runs every
+    flush_seconds and keeps going while batches come back full, which
+    bounds how far logs lags behind the requests that wrote the rows.
+    """
+
+    def __init__(self, batch_size: int, flush_seconds: float):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.batches = 0
+        self.rows = 0
+        self.last_batch = 0
+        self.max_batch = 0
+        self.errors = 0
+        # Outbox state when the last flush started
+        self.depth = 0
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self._task: asyncio.Task | None = None
+
+    def flush_batch(self) -> int:
+        with SessionLocal() as db:
+            moved = db.execute(_drain_stmt(self.batch_size)).rowcount
+            db.commit()
+        if moved:
+            self.batches += 1
+            self.rows += moved
+            self.last_batch = moved
+            self.max_batch = max(self.max_batch, moved)
+        return moved
+
+    def flush(self) -> int:
+        """Drain the outbox until a batch comes back short; returns the rows moved."""
+        self._observe()
+        moved = 0
+        while True:
+            batch = self.flush_batch()
+            moved += batch
+            if batch < self.batch_size:
+                return moved
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.LOG_WRITE_BEHIND,
+            "depth": self.depth,
+            "lag_ms": self.lag_ms,
+            "max_lag_ms": self.max_lag_ms,
+            "batches": self.batches,
+            "rows": self.rows,
+            "last_batch": self.last_batch,
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.rows / self.batches, 1) if self.batches else 0,
+            "errors": self.errors,
+        }
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop(), name="log-outbox-writer")
+
+    async def stop(self):
+        """Stop the loop and move whatever is still in the outbox."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        moved = await run_in_threadpool(self.flush)
+        if moved:
+            logger.info("flushed %d outbox log rows on shutdown", moved)
+
+    def _observe(self):
+        with SessionLocal() as db:
+            oldest = db.execute(select(LogOutbox.id, LogOutbox.logged_at).order_by(LogOutbox.id).limit(1)).first()
+            if oldest is None:
+                self.depth, self.lag_ms = 0, 0.0
+                return
+            newest = db.execute(select(LogOutbox.id).order_by(LogOutbox.id.desc()).limit(1)).scalar()
+        # Ids are handed out in order and only removed from the front, so this is exact up to gaps
+        self.depth = newest - oldest.id + 1
+        self.lag_ms = round((time.time() - oldest.logged_at.timestamp()) * 1000, 1)
+        self.max_lag_ms = max(self.max_lag_ms, self.lag_ms)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await run_in_threadpool(self.flush)
+            except Exception:
+                self.errors += 1
+                logger.exception("log_outbox_flush_failed")
+
+
+log_writer = LogOutboxWriter(settings.LOG_OUTBOX_BATCH, settings.LOG_OUTBOX_FLUSH_SECONDS)
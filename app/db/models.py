@@ -4,6 +4,8 @@ import enum
 from sqlalchemy import (
     Column,
     BigInteger,
+    Integer,
+    SmallInteger,
     String,
     Text,
     TIMESTAMP,
@@ -14,7 +16,7 @@ from sqlalchemy import (
     UniqueConstraint,
     func,
 )
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import Enum as SQLEnum
 
@@ -159,6 +161,10 @@ class Code(Base):
     __table_args__ = (
         Index("idx_codes_status_requested", "status", "requested_at"),
         Index("idx_codes_type_status", "code_type", "status"),
+        # Pool head for the reservation window: free codes of a type, oldest first
+        Index("idx_codes_pool_head", "code_type", "status", requested_at.asc().nullsfirst()),
+        # /admin/codes/all walks codes grouped by type and status, in code order
+        Index("idx_codes_type_status_code", "code_type", "status", "code"),
     )
 
     def __repr__(self) -> str:
@@ -170,9 +176,13 @@ class Code(Base):
 # ----------------------------
 
 class Log(Base):
+    """
+    Range-partitioned by month on logged_at (see app/db/ddl.py), so the
+    partition key is part of the primary key.
+    """
     __tablename__ = "logs"
 
-    id = Column(BigInteger, primary_key=True, index=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True, index=True)
 
     code = Column(String(64), nullable=False, index=True)
 
@@ -190,10 +200,123 @@ class Log(Base):
     country_name = Column(String(128), nullable=True, index=True)   # e.g. "United Kingdom"
 
     note = Column(Text, nullable=True)
-    logged_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False, index=True)
+    logged_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), primary_key=True, nullable=False, index=True)
 
     __table_args__ = (
         Index("idx_logs_code_action", "code", "action"),
         Index("idx_logs_user_action_time", "user_id", "action", "logged_at"),
         Index("idx_logs_region_country_time", "region_name", "country_name", "logged_at"),
-    )
\ No newline at end of file
+        # Code search: prefix matches on code, suffix matches as prefix matches on reverse(code).
+        # text_pattern_ops so LIKE can use them whatever the database collation
+        Index("idx_logs_code_pattern", code, postgresql_ops={"code": "text_pattern_ops"}),
+        Index("idx_logs_code_reverse", func.reverse(code).label("code_reversed"),
+              postgresql_ops={"code_reversed": "text_pattern_ops"}),
+        Index("idx_logs_user_name", "user_name"),
+        {"postgresql_partition_by": "RANGE (logged_at)"},
+    )
+
+
+class LogUserName(Base):
+    """
+    Every distinct logs.user_name, kept by a trigger on logs when pg_trgm is
+    unavailable (see app/db/ddl.py). Substring search runs over this small
+    table and then looks the matching names up in idx_logs_user_name.
+    """
+    __tablename__ = "log_user_names"
+
+    name = Column(String(320), primary_key=True)
+
+
+class LogOutbox(Base):
+    """
+    Audit rows waiting to be moved into logs when LOG_WRITE_BEHIND is on
+    (see app/db/log_outbox.py). Same columns as Log but no indexes or
+    foreign keys, so writing one costs the request transaction very little.
+    """
+    __tablename__ = "log_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    code = Column(String(64), nullable=False)
+    user_id = Column(BigInteger, nullable=True)
+    user_name = Column(String(320), nullable=True)
+    contact_email = Column(String(320), nullable=True)
+    tester_name = Column(Text, nullable=True)
+    action = Column(SQLEnum(CodeAction, name="code_action", native_enum=True), nullable=False)
+    region_name = Column(String(128), nullable=True)
+    country_name = Column(String(128), nullable=True)
+    note = Column(Text, nullable=True)
+    logged_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+
+# ----------------------------
+# Idempotency keys
+# ----------------------------
+
+class IdempotencyKey(Base):
+    """Stored response of a request made with an Idempotency-Key header, replayed on retries."""
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    key = Column(String(128), primary_key=True)
+
+    endpoint = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response = Column(JSONB, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+    def __repr__(self) -> str:
+        return f"<IdempotencyKey {self.user_id}:{self.key} {self.endpoint}>"
+
+
+# ----------------------------
+# Pool counters
+# ----------------------------
+
+class PoolCounter(Base):
+    """
+    Running number of codes per (code_type, status, country), kept by triggers
+    on codes / code_countries (see app/db/ddl.py). country_id 0 is the total
+    over all countries. Each key is spread over several slot rows so
+    concurrent reservations don't queue on one row; read it as sum(n).
+    """
+    __tablename__ = "pool_counters"
+
+    code_type = Column(String(16), primary_key=True)
+    status = Column(String(32), primary_key=True)
+    country_id = Column(BigInteger, primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+
+    n = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<PoolCounter {self.code_type}/{self.status}/{self.country_id}#{self.slot} {self.n}>"
+
+
+# ----------------------------
+# Usage rollups
+# ----------------------------
+
+class UsageRollup(Base):
+    """
+    Number of logs per hour and (action, region, country, code_type, team),
+    rebuilt from logs one closed hour at a time (see
+    app.db.admin.crud.rollup_usage). Unknown dimensions are stored as ''.
+    """
+    __tablename__ = "usage_rollups"
+
+    bucket = Column(TIMESTAMP(timezone=True), primary_key=True)
+    action = Column(SQLEnum(CodeAction, name="code_action", native_enum=True), primary_key=True)
+    region_name = Column(String(128), primary_key=True)
+    country_name = Column(String(128), primary_key=True)
+    code_type = Column(String(16), primary_key=True)
+    team_name = Column(String(100), primary_key=True)
+
+    n = Column(BigInteger, nullable=False)
+
+
+class RollupWatermark(Base):
+    """How far a rollup table has been built: every hour before upto is in it."""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(64), primary_key=True)
+    upto = Column(TIMESTAMP(timezone=True), nullable=False)
@@ -0,0 +1,44 @@
+import json
+from typing import Iterable
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# Postgres channel announcing codes that went back to CAN_BE_USED
+CODE_POOL_CHANNEL = "code_pool"
+
+
+def _notify_stmt(count: int, code_type, countries: Iterable[str] | None):
+    payload = {
+        "code_type": getattr(code_type, "value", code_type),
+        "countries": list(countries) if countries is not None else None,
+        "count": count,
+    }
+    return select(func.pg_notify(CODE_POOL_CHANNEL, json.dumps(payload)))
+
+
+def notify_codes_returned(
+    db: Session,
+    count: int,
+    code_type: str | None = None,
+    countries: Iterable[str] | None = None,
+):
+    """
+    Queue a NOTIFY for `count` codes returned to the pool. It is delivered
+    to every listening worker when the surrounding transaction commits and
+    dropped on rollback. code_type/countries of None mean "any".
+    """
+    if count:
+        db.execute(_notify_stmt(count, code_type, countries))
+
+
+async def notify_codes_returned_async(
+    db: AsyncSession,
+    count: int,
+    code_type: str | None = None,
+    countries: Iterable[str] | None = None,
+):
+    """notify_codes_returned for an AsyncSession."""
+    if count:
+        await db.execute(_notify_stmt(count, code_type, countries))
@@ -0,0 +1,175 @@
+"""
+AsyncSession versions of the crud used by the user request handlers.
+
+Statements are built by the helpers in app.db.users.crud, which otherwise
+only keeps what background jobs, the reservation buffer and the benchmarks
+run on the sync engine.
+"""
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.config import settings
+from app.core.exceptions import NoCodesAvailableError
+from app.db.models import Code, Log, User, CodeStatus, CodeType, Country, IdempotencyKey
+from app.db.pool_events import notify_codes_returned_async
+from app.db.users.crud import _assign_held_stmt, _release_stmt, _reserve_stmt
+
+
+async def _claim_codes(
+    db: AsyncSession,
+    user: User,
+    tester_name: str | None,
+    country: str | None,
+    code_type: str,
+    count: int,
+    selection: str | None = None,
+) -> list:
+    selection = selection or settings.RESERVE_SELECTION
+    rows = (await db.execute(
+        _reserve_stmt(user=user, tester_name=tester_name, country=country,
+                      code_type=code_type, count=count, selection=selection)
+    )).all()
+
+    # Every code in the window was locked by someone else; walk the rest of the pool
+    if len(rows) < count and selection == "window":
+        rows += (await db.execute(
+            _reserve_stmt(user=user, tester_name=tester_name, country=country,
+                          code_type=code_type, count=count - len(rows), selection="head")
+        )).all()
+    return rows
+
+
+async def reserve_one_code(
+    db: AsyncSession,
+    user: User,
+    tester_name: str | None,
+    country: str | None,
+    code_type: str,
+    selection: str | None = None,
+):
+    """See crud.reserve_one_code."""
+    if settings.RESERVATION_BUFFER_ENABLED:
+        from app.db.users.buffer import reservation_buffer
+
+        held = reservation_buffer.take(code_type, country)
+        if held is not None:
+            row = (await db.execute(_assign_held_stmt(held.code, held.token, user, tester_name, country))).first()
+            if row is not None:
+                reservation_buffer.restore_unless_committed(db.sync_session, code_type, country, held)
+                return row
+
+    rows = await _claim_codes(db, user, tester_name, country, code_type, count=1, selection=selection)
+    if not rows:
+        raise NoCodesAvailableError()
+    return rows[0]
+
+
+async def reserve_codes(
+    db: AsyncSession,
+    user: User,
+    tester_name: str | None,
+    country: str | None,
+    code_type: str,
+    count: int,
+) -> list:
+    """
+    Claim up to `count` codes with the same statement as reserve_one_code.
+    Team codes come first, then the COMMON fallbacks; fewer than `count`
+    rows means the pools ran dry.
+    """
+    rows = await _claim_codes(db, user, tester_name, country, code_type, count=count)
+    if not rows:
+        raise NoCodesAvailableError()
+    ct = CodeType(code_type) if isinstance(code_type, str) else code_type
+    return sorted(rows, key=lambda r: r.code_type != ct)
+
+
+async def release_reserved_codes(
+    db: AsyncSession,
+    user: User,
+    codes: Optional[list[str]] = None,
+    clearance_id: Optional[str] = None,
+    note: Optional[str] = None,
+) -> list[str]:
+    """
+    Release the given codes reserved by `user`, or all of them when `codes`
+    is None, in one statement that also writes their RELEASED logs. Returns
+    the codes actually released; codes `user` does not hold are skipped.
+    """
+    released_codes = list((await db.execute(_release_stmt(user, codes, clearance_id, note))).scalars())
+    await notify_codes_returned_async(db, len(released_codes))
+    return released_codes
+
+
+async def release_reserved_code(
+    db: AsyncSession,
+    code: str,
+    user: User,
+    clearance_id: Optional[str] = None,
+    note: Optional[str] = None,
+) -> str:
+    if not await release_reserved_codes(db, user, [code], clearance_id=clearance_id, note=note):
+        raise ValueError(f"Code '{code}' not found.")
+    return code
+
+
+async def claim_idempotency_key(db: AsyncSession, user_id: int, key: str, endpoint: str) -> IdempotencyKey | None:
+    """
+    Claim (user_id, key) for this transaction. Returns None when the key is
+    new; otherwise the stored row of the earlier request. A concurrent
+    request with the same key blocks here until the first one finishes.
+    """
+    claimed = (await db.execute(
+        pg_insert(IdempotencyKey)
+        .values(user_id=user_id, key=key, endpoint=endpoint)
+        .on_conflict_do_nothing(index_elements=[IdempotencyKey.user_id, IdempotencyKey.key])
+        .returning(IdempotencyKey.key)
+    )).first()
+    if claimed:
+        return None
+    return await db.get(IdempotencyKey, (user_id, key))
+
+
+async def store_idempotent_response(db: AsyncSession, user_id: int, key: str, status_code: int, body):
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        .values(status_code=status_code, response=body)
+    )
+
+
+async def list_of_codes(db: AsyncSession, user):
+    stmt = (
+        select(Code)
+        .options(selectinload(Code.countries).selectinload(Country.region))
+        .where(Code.user_id == user.id, Code.status == CodeStatus.RESERVED)
+        .order_by(Code.requested_at.desc())
+    )
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def user_logs(db: AsyncSession, user_id: int):
+    stmt = (
+        select(Log)
+        .where(Log.user_id == user_id)
+        .order_by(Log.logged_at.desc())
+        .limit(20)
+    )
+    return (await db.execute(stmt)).scalars().all()
+
+
+async def get_all_countries(db: AsyncSession):
+    return (await db.execute(select(Country.id, Country.name))).all()
+
+
+async def add_or_update_comment(db: AsyncSession, code, comment):
+    db_code = (await db.execute(select(Code).where(Code.code == code))).scalars().first()
+    if not db_code:
+        raise NoCodesAvailableError("Code not found or cannot be deleted")
+
+    db_code.note = comment
+    return db_code
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db.engine import SessionLocal
+from app.db.models import CodeType
+from app.db.users import crud
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class HeldCode:
+    code: str
+    token: object
+    held_at: float
+
+
+class ReservationBuffer:
+    """
+    Worker-local stock of pre-claimed codes per (code_type, country) pool.
+
+    Codes are claimed from Postgres in batches (RESERVED with no holder) and
+    handed out from memory; crud.assign_held_code then binds the code to the
+    user by primary key and writes the RESERVED log as usual. A pool is
+    refilled in the background once it drops below the low-water mark, and
+    holds older than hold_seconds, or still unused on shutdown, are put back.
+    A code taken by a request whose transaction then fails to commit goes
+    back into its pool rather than being left RESERVED with no holder.
+    """
+
+    def __init__(self, batch_size: int, low_water: int, hold_seconds: int):
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.hold_seconds = hold_seconds
+        self._pools: dict[tuple, deque[HeldCode]] = defaultdict(deque)
+        self._refilling: set[tuple] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._executor: ThreadPoolExecutor | None = None
+        self._reaper: threading.Thread | None = None
+
+    @staticmethod
+    def _key(code_type, country):
+        ct = CodeType(code_type) if isinstance(code_type, str) else code_type
+        # COMMON codes ignore the country
+        return ct, (None if ct == CodeType.COMMON else country)
+
+    def start(self):
+        # The stale-reservation sweep can't tell a hold from a reservation and would release it with a RELEASED log
+        if self.hold_seconds >= settings.RESERVATION_TTL_MINUTES * 60:
+            raise ValueError("RESERVATION_BUFFER_HOLD_SECONDS must be below RESERVATION_TTL_MINUTES * 60")
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reservation-buffer")
+        self._reaper = threading.Thread(target=self._reap_loop, name="reservation-buffer-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            held = [c for pool in self._pools.values() for c in pool]
+            self._pools.clear()
+        self._return(held)
+
+    def take(self, code_type, country) -> HeldCode | None:
+        if self._executor is None:
+            return None
+        key = self._key(code_type, country)
+        now = time.monotonic()
+        stale: list[HeldCode] = []
+        held = None
+        with self._lock:
+            pool = self._pools[key]
+            while pool:
+                candidate = pool.popleft()
+                if now - candidate.held_at < self.hold_seconds:
+                    held = candidate
+                    break
+                stale.append(candidate)
+            refill = len(pool) < self.low_water and key not in self._refilling
+            if refill:
+                self._refilling.add(key)
+        if stale:
+            self._submit(self._return, stale)
+        if refill:
+            self._submit(self._refill, key)
+        return held
+
+    def restore_unless_committed(self, db: Session, code_type, country, held: HeldCode):
+        """
+        Put held back at the front of its pool if db's transaction ends
+        without committing (rollback, failed commit or close), since the
+        code is then still this worker's hold.
+        """
+        key = self._key(code_type, country)
+        state = {"committed": False, "done": False}
+
+        def on_commit(_session):
+            state["committed"] = True
+
+        def on_end(_session, transaction):
+            if transaction.parent is not None or state["done"]:
+                return
+            state["done"] = True
+            if not state["committed"]:
+                with self._lock:
+                    self._pools[key].appendleft(held)
+
+        event.listen(db, "after_commit", on_commit)
+        event.listen(db, "after_transaction_end", on_end)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {f"{ct.value}:{country or '*'}": len(pool) for (ct, country), pool in self._pools.items()}
+
+    def _submit(self, fn, *args):
+        try:
+            self._executor.submit(fn, *args)
+        except (AttributeError, RuntimeError):
+            # Shutting down; stop() returns whatever is still held
+            if fn == self._refill:
+                with self._lock:
+                    self._refilling.discard(args[0])
+
+    def _refill(self, key):
+        try:
+            with SessionLocal() as db:
+                rows = crud.hold_codes(db, key[0], key[1], self.batch_size)
+                db.commit()
+            now = time.monotonic()
+            with self._lock:
+                self._pools[key].extend(HeldCode(r.code, r.reservation_token, now) for r in rows)
+        except Exception:
+            logger.exception("reservation_buffer_refill_failed")
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def _return(self, held: list[HeldCode]):
+        if not held:
+            return
+        try:
+            with SessionLocal() as db:
+                crud.return_held_codes(db, [(c.code, c.token) for c in held])
+                db.commit()
+        except Exception:
+            logger.exception("reservation_buffer_return_failed")
+
+    def _reap_loop(self):
+        while not self._stopped.wait(max(self.hold_seconds / 2, 1)):
+            cutoff = time.monotonic() - self.hold_seconds
+            with self._lock:
+                stale = []
+                for pool in self._pools.values():
+                    while pool and pool[0].held_at < cutoff:
+                        stale.append(pool.popleft())
+            self._return(stale)
+
+
+reservation_buffer = ReservationBuffer(
+    batch_size=settings.RESERVATION_BUFFER_BATCH,
+    low_water=settings.RESERVATION_BUFFER_LOW_WATER,
+    hold_seconds=settings.RESERVATION_BUFFER_HOLD_SECONDS,
+)
@@ -1,11 +1,13 @@
-import uuid
 from zoneinfo import ZoneInfo
 
+from app.config import settings
 from app.core.exceptions import NoCodesAvailableError
-from sqlalchemy import desc, select
-from datetime import datetime
+from sqlalchemy import and_, delete, select, case, cast, func, insert, literal, null, or_, true, tuple_, union_all
+from datetime import datetime, timedelta
 from sqlalchemy import  update
 from sqlalchemy.orm import Session
+from app.db.pool_events import notify_codes_returned
+from app.db.log_outbox import log_table
 from app.db.models import (Code,
                            Log,
                            User,
@@ -13,123 +15,371 @@ from app.db.models import (Code,
                            CodeAction,
                            CodeType,
                            Region,
-                           Country)
+                           Country,
+                           IdempotencyKey,
+                           code_countries)
 from typing import Optional
-from sqlalchemy.orm import joinedload
 
 
 
-def reserve_one_code(
-    db: Session,
-    user: User,
-    tester_name: str | None,
+
+def _candidates(
+    code_type: CodeType,
     country: str | None,
-    code_type: str,
-) -> Code:
-
-    def _reserve_code(
-        code_type: CodeType,
-        country: str | None = None,
-        user_id: int | None = None,
-        tester_name: str | None = None,
-        contact_email: str | None = None,
-    ) -> Code | None:
-        # Normalize to Enum
-        ct = CodeType(code_type) if isinstance(code_type, str) else code_type
-        # Start with status + code_type filter
-        query = (
-            db.query(Code)
-            .filter(
-                (Code.status == CodeStatus.CAN_BE_USED.value) &   # use Enum, not .value
-                (Code.code_type == ct)
+    count: int,
+    selection: str = "head",
+    fallback: bool = True,
+):
+    """
+    Locking subquery selecting up to `count` free codes.
+
+    selection="head" locks strictly oldest-first. selection="window" reads the
+    oldest RESERVE_WINDOW_SIZE free codes of each tier without locking and
+    locks a random subset of them, so concurrent reservers spread over the
+    window instead of all queueing behind the same head rows.
+    With fallback=True the COMMON pool is ordered after the team pool.
+    """
+    ct = code_type
+
+    # For non-COMMON, restrict by associated country
+    team_pool = Code.code_type == ct
+    if ct != CodeType.COMMON and country:
+        team_pool = team_pool & Code.countries.any(Country.name == country)
+    fallback = fallback and ct != CodeType.COMMON
+    team_first = case((Code.code_type == ct, 0), else_=1)
+
+    if selection == "window":
+        # Oldest free codes of each tier, read straight off idx_codes_pool_head without locking
+        def oldest(tier):
+            return (
+                select(Code.code)
+                .where(Code.status == CodeStatus.CAN_BE_USED.value, tier)
+                .order_by(Code.requested_at.nullsfirst())
+                .limit(settings.RESERVE_WINDOW_SIZE + count)
             )
+
+        window = oldest(team_pool)
+        if fallback:
+            window = union_all(window, oldest(Code.code_type == CodeType.COMMON))
+        window = window.subquery("pool_window")
+
+        # Status is re-checked by the locking read; random order inside each tier
+        candidates = (
+            select(Code.code)
+            .where(Code.code.in_(select(window.c.code)), Code.status == CodeStatus.CAN_BE_USED.value)
+            .order_by(team_first, func.random())
+        )
+    else:
+        # Team pool first, oldest first, NULLs first
+        candidates = (
+            select(Code.code)
+            .where(
+                Code.status == CodeStatus.CAN_BE_USED.value,
+                or_(team_pool, Code.code_type == CodeType.COMMON) if fallback else team_pool,
+            )
+            .order_by(team_first, Code.requested_at.nullsfirst())
         )
 
-        # For non-COMMON, restrict by associated country
-        if ct != CodeType.COMMON and country:
-            query = query.join(Code.countries).filter(Country.name == country)
+    # Lock the candidates, skipping rows held by other reservers
+    return candidates.limit(count).with_for_update(skip_locked=True).scalar_subquery()
+
+
+def _with_reservation_log(reserved, user: User, tester_name: str | None, country: str | None, now: datetime):
+    """
+    Attach the RESERVED log insert to a `reserved` UPDATE ... RETURNING CTE and
+    select code, code_type, reservation_token and region_name from both.
+    """
+    # Region of the requested country, only for codes that are actually valid there
+    if country:
+        region_name = (
+            select(Region.name)
+            .join(Country, Country.region_id == Region.id)
+            .join(code_countries, code_countries.c.country_id == Country.id)
+            .where(code_countries.c.code == reserved.c.code, Country.name == country)
+            .limit(1)
+            .scalar_subquery()
+        )
+    else:
+        region_name = null()
+
+    target = log_table()
+    logged = (
+        insert(target)
+        .from_select(
+            ["code", "user_id", "action", "user_name", "contact_email",
+             "tester_name", "region_name", "country_name", "logged_at"],
+            select(
+                reserved.c.code,
+                literal(user.id),
+                cast(literal(CodeAction.RESERVED.value), Log.action.type),
+                literal(user.user_name),
+                literal(user.contact_email),
+                literal(tester_name),
+                region_name,
+                literal(country),
+                literal(now),
+            ),
+        )
+        .returning(target.code, target.region_name)
+        .cte("logged")
+    )
 
-        # Lock a single candidate row (oldest first, NULLs first)
-        query = query.order_by(Code.requested_at.nullsfirst()).with_for_update(skip_locked=True)
+    return (
+        select(
+            reserved.c.code,
+            reserved.c.code_type,
+            reserved.c.reservation_token,
+            logged.c.region_name,
+        )
+        .join_from(reserved, logged, logged.c.code == reserved.c.code)
+    )
 
-        candidate: Code | None = query.first()
-        if not candidate:
-            return None
 
-        now = now = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
+def _reserve_stmt(
+    user: User,
+    tester_name: str | None,
+    country: str | None,
+    code_type: str | CodeType,
+    count: int,
+    selection: str = "head",
+):
+    """
+    Build the single-statement reservation:
+
+        WITH reserved AS (
+            UPDATE codes SET ... WHERE code IN (
+                SELECT code ... ORDER BY <team pool first>, requested_at
+                LIMIT :count FOR UPDATE SKIP LOCKED)
+            RETURNING code, code_type, reservation_token),
+        logged AS (INSERT INTO logs (...) SELECT ... FROM reserved RETURNING code, region_name)
+        SELECT code, code_type, reservation_token, region_name FROM reserved JOIN logged
+
+    The COMMON fallback is handled by ordering, so a miss on the team pool
+    costs nothing extra.
+    """
+    ct = CodeType(code_type) if isinstance(code_type, str) else code_type
+    now = datetime.now(ZoneInfo("Asia/Kolkata"))
+
+    reserved = (
+        update(Code)
+        .where(Code.code.in_(_candidates(ct, country, count, selection)))
+        .values(
+            user_id=user.id,
+            tester_name=tester_name,
+            requested_at=now,
+            reservation_token=func.gen_random_uuid(),
+            status=CodeStatus.RESERVED.value,
+            released_at=None,
+        )
+        .returning(Code.code, Code.code_type, Code.reservation_token)
+        .cte("reserved")
+    )
 
-        # Update fields
-        candidate.user_id = user_id
-        candidate.tester_name = tester_name
-        candidate.requested_at = now
-        candidate.reservation_token = uuid.uuid4()
-        candidate.status = CodeStatus.RESERVED.value   # assign Enum directly
-        candidate.released_at = None
+    stmt = _with_reservation_log(reserved, user, tester_name, country, now)
+    return stmt.order_by(case((reserved.c.code_type == ct, 0), else_=1))
 
-        db.flush()
 
-        # Compute region name if possible
-        region_name = None
-        if country:
-            match = next((cou for cou in candidate.countries if cou.name == country), None)
-            if match and match.region:
-                region_name = match.region.name
+def hold_codes(db: Session, code_type: CodeType, country: str | None, count: int) -> list:
+    """
+    Pre-claim up to `count` codes of exactly this pool for the in-process
+    reservation buffer. Held codes are RESERVED with no holder; the
+    reservation_token doubles as the hold token. No log is written until a
+    held code is handed to a user.
+    """
+    stmt = (
+        update(Code)
+        .where(Code.code.in_(_candidates(code_type, country, count, settings.RESERVE_SELECTION, fallback=False)))
+        .values(
+            user_id=None,
+            tester_name=None,
+            requested_at=datetime.now(ZoneInfo("Asia/Kolkata")),
+            reservation_token=func.gen_random_uuid(),
+            status=CodeStatus.RESERVED.value,
+            released_at=None,
+        )
+        .returning(Code.code, Code.reservation_token)
+    )
+    return db.execute(stmt).all()
+
 
-        # Log the reservation
-        db.add(Log(
-            code=candidate.code,
+def _assign_held_stmt(code: str, hold_token, user: User, tester_name: str | None, country: str | None):
+    now = datetime.now(ZoneInfo("Asia/Kolkata"))
+    reserved = (
+        update(Code)
+        .where(
+            Code.code == code,
+            Code.reservation_token == hold_token,
+            Code.user_id.is_(None),
+            Code.status == CodeStatus.RESERVED.value,
+        )
+        .values(
             user_id=user.id,
-            action=CodeAction.RESERVED.value,
-            user_name=user.user_name,
-            contact_email=user.contact_email,
             tester_name=tester_name,
-            region_name=region_name,
-            country_name=country,
-            logged_at=now,
-        ))
-        db.flush()
-
-        return candidate
-
-    # Priority 1: Try with requested code_type
-    row = _reserve_code(
-        code_type=code_type,
-        country=country,
-        user_id=user.id,
-        tester_name=tester_name,
-        contact_email=user.contact_email,
-    )
-    if row:
-        return row
-
-    # Priority 2: Fallback to COMMON type (ignores country restriction if COMMON)
-    row = _reserve_code(
-        code_type=CodeType.COMMON,
-        country=country,
-        user_id=user.id,
-        tester_name=tester_name,
-        contact_email=user.contact_email,
+            requested_at=now,
+            reservation_token=func.gen_random_uuid(),
+        )
+        .returning(Code.code, Code.code_type, Code.reservation_token)
+        .cte("reserved")
     )
-    if row:
-        return row
+    return _with_reservation_log(reserved, user, tester_name, country, now)
 
-    # Nothing available
-    raise NoCodesAvailableError()
 
-def release_reserved_code(
+def assign_held_code(
     db: Session,
     code: str,
+    hold_token,
+    user: User,
+    tester_name: str | None,
+    country: str | None,
+):
+    """
+    Hand a held code to `user` by primary key, with the usual RESERVED log.
+    Returns None if the hold was lost (e.g. swept back into the pool).
+    """
+    return db.execute(_assign_held_stmt(code, hold_token, user, tester_name, country)).first()
+
+
+def return_held_codes(db: Session, held: list) -> int:
+    """Put unused held codes, given as (code, hold_token) pairs, back into the pool."""
+    if not held:
+        return 0
+    stmt = (
+        update(Code)
+        .where(
+            tuple_(Code.code, Code.reservation_token).in_([(c, t) for c, t in held]),
+            Code.user_id.is_(None),
+            Code.status == CodeStatus.RESERVED.value,
+        )
+        .values(
+            status=CodeStatus.CAN_BE_USED.value,
+            reservation_token=None,
+            requested_at=None,
+        )
+    )
+    returned = db.execute(stmt).rowcount
+    notify_codes_returned(db, returned)
+    return returned
+
+
+def _claim_codes(
+    db: Session,
     user: User,
+    tester_name: str | None,
+    country: str | None,
+    code_type: str,
+    count: int,
+    selection: str | None = None,
+) -> list:
+    selection = selection or settings.RESERVE_SELECTION
+    rows = db.execute(
+        _reserve_stmt(user=user, tester_name=tester_name, country=country,
+                      code_type=code_type, count=count, selection=selection)
+    ).all()
+
+    # Every code in the window was locked by someone else; walk the rest of the pool
+    if len(rows) < count and selection == "window":
+        rows += db.execute(
+            _reserve_stmt(user=user, tester_name=tester_name, country=country,
+                          code_type=code_type, count=count - len(rows), selection="head")
+        ).all()
+    return rows
+
+
+def reserve_one_code(
+    db: Session,
+    user: User,
+    tester_name: str | None,
+    country: str | None,
+    code_type: str,
+    selection: str | None = None,
+):
+    """
+    Reserve one code, normally in a single round trip.
+    Returns a row with code, code_type, reservation_token and region_name.
+    With RESERVATION_BUFFER_ENABLED a code pre-claimed by this worker is
+    handed out first.
+    """
+    if settings.RESERVATION_BUFFER_ENABLED:
+        from app.db.users.buffer import reservation_buffer
+
+        held = reservation_buffer.take(code_type, country)
+        if held is not None:
+            row = assign_held_code(db, held.code, held.token, user, tester_name, country)
+            if row is not None:
+                reservation_buffer.restore_unless_committed(db, code_type, country, held)
+                return row
+
+    rows = _claim_codes(db, user, tester_name, country, code_type, count=1, selection=selection)
+    if not rows:
+        # Nothing available
+        raise NoCodesAvailableError()
+    return rows[0]
+
+
+def _first_country(code_col):
+    """Lateral lookup of a code's first associated country and its region, for release logs."""
+    return (
+        select(Country.name.label("country_name"), Region.name.label("region_name"))
+        .select_from(code_countries)
+        .join(Country, Country.id == code_countries.c.country_id)
+        .outerjoin(Region, Region.id == Country.region_id)
+        .where(code_countries.c.code == code_col)
+        .order_by(Country.id)
+        .limit(1)
+        .lateral("first_country")
+    )
+
+
+def _log_released(released, now: datetime, note, user: User | None = None):
+    """
+    INSERT ... SELECT of RELEASED logs for a `released` UPDATE ... RETURNING
+    CTE, tagged with the code's first country/region. Without `user` the
+    holder is read from released.c.user_id / released.c.tester_name.
+    """
+    first_country = _first_country(released.c.code)
+    source = select(
+        released.c.code,
+        released.c.user_id if user is None else literal(user.id),
+        cast(literal(CodeAction.RELEASED.value), Log.action.type),
+        User.user_name if user is None else literal(user.user_name),
+        User.contact_email if user is None else literal(user.contact_email),
+        released.c.tester_name if user is None else null(),
+        first_country.c.region_name,
+        first_country.c.country_name,
+        literal(note),
+        literal(now),
+    ).select_from(released)
+    if user is None:
+        source = source.outerjoin(User, User.id == released.c.user_id)
+    source = source.outerjoin(first_country, true())
+
+    target = log_table()
+    return (
+        insert(target)
+        .from_select(
+            ["code", "user_id", "action", "user_name", "contact_email",
+             "tester_name", "region_name", "country_name", "note", "logged_at"],
+            source,
+        )
+        .returning(target.code)
+        .cte("logged")
+    )
+
+
+def _release_stmt(
+    user: User,
+    codes: Optional[list[str]] = None,
     clearance_id: Optional[str] = None,
     note: Optional[str] = None,
-) -> str:
+):
+    """UPDATE ... RETURNING of the codes to release plus their RELEASED logs; selects the released codes."""
+    now = datetime.now(ZoneInfo("Asia/Kolkata"))
 
-    now = datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y %I:%M:%S %p")
-
-    # Step 1: Update the reserved code
-    stmt = (
+    # Only the caller's own reservations; codes held by others or by the reservation buffer are left alone
+    target = Code.user_id == user.id if codes is None else and_(Code.user_id == user.id, Code.code.in_(codes))
+    released = (
         update(Code)
-        .where(Code.code == code, Code.status == CodeStatus.RESERVED.value)
+        .where(target, Code.status == CodeStatus.RESERVED.value)
         .values(
             status=CodeStatus.CAN_BE_USED.value,
             user_id=None,
@@ -140,78 +390,66 @@ def release_reserved_code(
             note=note,
         )
         .returning(Code.code)
+        .cte("released")
     )
+    logged = _log_released(released, now, clearance_id if clearance_id else note, user=user)
+    return select(logged.c.code)
 
-    result = db.execute(stmt).fetchone()
-    if not result:
-        raise ValueError(f"Code '{code}' not found.")
-
-    # Fetch the full code object with relationships (for region/country info)
-    code_obj = db.query(Code).filter_by(code=code).first()
-
-    # Extract region + country info
-    region_name = None
-    country_name = None
-    if code_obj and code_obj.countries:
-        # Just take the first associated country
-        country = code_obj.countries[0]
-        country_name = country.name
-        region_name = country.region.name if country.region else None
-
-    # Step 2: Add log entry
-    log_entry = Log(
-        code=code,
-        action=CodeAction.RELEASED.value,
-        user_id=user.id,
-        user_name=user.user_name,
-        contact_email=user.contact_email,
-        logged_at=now,
-        note=clearance_id if  clearance_id else note,
-        region_name=region_name,
-        country_name=country_name,
-    )
 
-    db.add(log_entry)
-    return code
-
-
-
-def list_of_codes(db: Session, user):
-    codes = (
-        db.query(Code)
-        .options(
-            joinedload(Code.countries).joinedload(Country.region)  # eager load countries + their region
+def expire_stale_reservations(
+    db: Session,
+    ttl_minutes: int | None = None,
+    batch_size: int | None = None,
+) -> list[str]:
+    """
+    Release up to `batch_size` codes reserved more than `ttl_minutes` ago,
+    oldest first, and write their RELEASED logs in the same statement.
+    Returns the released codes; a full batch means there may be more.
+    """
+    ttl_minutes = ttl_minutes or settings.RESERVATION_TTL_MINUTES
+    batch_size = batch_size or settings.RESERVATION_SWEEP_BATCH_SIZE
+    now = datetime.now(ZoneInfo("Asia/Kolkata"))
+
+    # Walks idx_codes_status_requested; rows someone is releasing right now are skipped
+    stale = (
+        select(Code.code, Code.user_id, Code.tester_name)
+        .where(
+            Code.status == CodeStatus.RESERVED.value,
+            Code.requested_at < now - timedelta(minutes=ttl_minutes),
         )
-        .filter(Code.user_id == user.id, Code.status == CodeStatus.RESERVED)
-        .order_by(Code.requested_at.desc())
-        .all()
+        .order_by(Code.requested_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .subquery("stale")
     )
-    return codes
-
 
-def user_logs(db: Session, user_id: int):
-    stmt = (
-        select(Log)
-        .where(Log.user_id == user_id)
-        .order_by(Log.logged_at.desc())
-        .limit(20)
+    released = (
+        update(Code)
+        .where(Code.code == stale.c.code)
+        .values(
+            status=CodeStatus.CAN_BE_USED.value,
+            user_id=None,
+            tester_name=None,
+            reservation_token=None,
+            requested_at=None,
+            released_at=now,
+        )
+        .returning(Code.code, stale.c.user_id, stale.c.tester_name)
+        .cte("released")
     )
-    result = db.execute(stmt).scalars().all()
-    return result
 
-def get_all_countries(db: Session):
-    stmt = select(Country.id, Country.name)
-    result = db.execute(stmt).all()
-    return result
+    logged = _log_released(released, now, "Reservation expired")
+
+    expired = list(db.execute(select(logged.c.code)).scalars())
+    notify_codes_returned(db, len(expired))
+    return expired
 
 
-def add_or_update_comment(db:Session,code,comment):
-    db_code=db.query(Code).filter(Code.code==code).first()
-    if not db_code:
-        raise NoCodesAvailableError("Code not found or cannot be deleted")
+def purge_idempotency_keys(db: Session, ttl_seconds: int | None = None) -> int:
+    ttl_seconds = ttl_seconds or settings.IDEMPOTENCY_TTL_SECONDS
+    cutoff = datetime.now(ZoneInfo("Asia/Kolkata")) - timedelta(seconds=ttl_seconds)
+    return db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff)).rowcount
 
-    db_code.note=comment
-    return db_code
 
 # def mark_non_usable(
 #     db: Session,
@@ -3,11 +3,13 @@ from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import logging
+import anyio.to_thread
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from sqlalchemy import text as sa_text
 from app.db.base import Base
-from app.db.engine import engine, SessionLocal
+from app.db.engine import engine, async_engine, SessionLocal
+from app.db.ddl import ensure_indexes, ensure_log_partitions, ensure_log_search, ensure_pool_counter_triggers
 from app.api.auth.auth import router as auth_router
 from app.api.user.users import router as users_router
 from app.api.admin.admin import router as admin_router
@@ -18,25 +20,45 @@ from app.core.exceptions import (AppError,
                                  InvalidReservationError,
                                  PermissionDeniedError,
                                  UsersOnlyError,
+                                 ServiceOverloadedError,
                                  )
 from app.db.models import User
+from app.db.users.buffer import reservation_buffer
+from app.core.maintenance import maintenance
+from app.core.wait_queue import pool_waiters
+from app.db.log_outbox import log_writer
+from app.config import settings
 from app.core.security import get_password_hash
+from app.core.hashing import password_hasher
+from app.core.admission import AdmissionMiddleware, admission
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-executor = ThreadPoolExecutor(max_workers=15)
+# Thread work is background jobs on the sync engine; more threads than connections would only queue on the pool
+SYNC_WORKERS = settings.SYNC_DB_POOL_SIZE + settings.SYNC_DB_MAX_OVERFLOW
+executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     loop = asyncio.get_running_loop()
     loop.set_default_executor(executor)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = SYNC_WORKERS
+
+    admitted = sum(c.max_limit for c in admission.classes.values())
+    if settings.ADMISSION_ENABLED and admitted > settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW:
+        logger.warning("Admission limits allow %d concurrent requests but the database pool holds %d connections",
+                       admitted, settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW)
 
     # DB setup
     ensure_enum_exists()
     Base.metadata.create_all(bind=engine)
+    ensure_log_partitions(engine)
+    ensure_indexes(engine)
+    ensure_log_search(engine)
+    ensure_pool_counter_triggers(engine)
 
     db = SessionLocal()
     try:
@@ -65,8 +87,30 @@ async def lifespan(app: FastAPI):
     finally:
         db.close()
 
+    if settings.RESERVATION_BUFFER_ENABLED:
+        reservation_buffer.start()
+    # Seed / repair the pool counters before /admin/count is served from them
+    await maintenance.run("reconcile_pool_counters")
+    await maintenance.start()
+    await pool_waiters.start()
+    if settings.LOG_WRITE_BEHIND:
+        await log_writer.start()
+    else:
+        # Rows left in the outbox from a run with write-behind on
+        log_writer.flush()
+
     logger.info(" ----------------- Startup complete. App is running ---------------------")
     yield
+    await pool_waiters.stop()
+    await maintenance.stop()
+    if settings.RESERVATION_BUFFER_ENABLED:
+        logger.info("------------------ Returning buffered codes to the pool ----------------")
+        reservation_buffer.stop()
+    if settings.LOG_WRITE_BEHIND:
+        logger.info("------------------ Flushing the audit log outbox ------------------------")
+        await log_writer.stop()
+    password_hasher.stop()
+    await async_engine.dispose()
     logger.info("------------------ Shutting down thread pool... ------------------------")
     executor.shutdown(wait=True)
     logger.info("------------------ Thread pool shut down successfully -------------------")
@@ -76,6 +120,9 @@ app = FastAPI(title="promo-tool",lifespan=lifespan)
 app.include_router(auth_router)
 app.include_router(users_router)
 app.include_router(admin_router)
+if settings.ADMISSION_ENABLED:
+    # Innermost, so shed responses still get CORS headers
+    app.add_middleware(AdmissionMiddleware, controller=admission)
 origins = [
     "http://146.205.10.159:8000",
     "http://146.205.10.159:5173",
@@ -135,6 +182,14 @@ async def permission_denied_handler(request: Request, exc: PermissionDeniedError
 async def user_only_handler(request: Request, exc: UsersOnlyError):
     return JSONResponse(status_code=403, content={"detail": "Users only"})
 
+@app.exception_handler(ServiceOverloadedError)
+async def service_overloaded_handler(request: Request, exc: ServiceOverloadedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": exc.message or "Service overloaded"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 @app.exception_handler(AppError)
 async def app_error_handler(request: Request, exc: AppError):
     return JSONResponse(status_code=400, content={"detail": exc.message or "Application error"})
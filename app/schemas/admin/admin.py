@@ -47,6 +47,25 @@ class CreateUserResponse(BaseModel):
         from_attributes = True
 
 
+class BulkCreateUsersRequest(BaseModel):
+    users: list[CreateUserRequest] = Field(..., min_length=1, max_length=1000)
+
+    class Config:
+        from_attributes = True
+
+
+class SkippedUser(BaseModel):
+    contact_email: Optional[str] = None
+    reason: Literal["already_exists", "duplicate_in_request", "invalid_row"]
+    detail: Optional[str] = None
+
+
+class BulkCreateUsersResponse(BaseModel):
+    requested: int
+    created: list[CreateUserResponse]
+    skipped: list[SkippedUser]
+
+
 class DeleteUserRequest(BaseModel):
     id : int
 
@@ -141,6 +160,13 @@ class AddEkCodeResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class AddEkCodesCsvResponse(BaseModel):
+    inserted: int
+    attached: int
+    failed: list[tuple[str, str]]
+    failed_count: int
+    unknown_countries: list[str]
+
 class LogSchema(BaseModel):
     id: int
     code: str
@@ -163,6 +189,11 @@ class LogSchema(BaseModel):
 class LogsResponse(BaseModel):
     total_count: int
     logs: list[LogSchema]
+    # Pass back as ?cursor= for the older / newer page; None when there is nothing further that way
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    # "exact", "estimated" (planner estimate) or "cached" (may trail recent changes briefly)
+    count_mode: str = "exact"
     class Config:
         from_attributes = True
 
@@ -170,4 +201,22 @@ class GetAllCountriesResponse(BaseModel):
     id:int
     country:str
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class UsageStatsRow(BaseModel):
+    # Only the group_by fields are returned; null where the logs don't say (e.g. no team for admin actions)
+    bucket: Optional[datetime] = None
+    action: Optional[str] = None
+    region: Optional[str] = None
+    country: Optional[str] = None
+    code_type: Optional[str] = None
+    team: Optional[str] = None
+    count: int
+
+class UsageStatsResponse(BaseModel):
+    start: datetime
+    end: datetime
+    group_by: list[str]
+    # Hours before this come from the rollups, later ones are counted from logs directly
+    rolled_up_to: Optional[datetime] = None
+    rows: list[UsageStatsRow]
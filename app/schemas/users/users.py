@@ -1,12 +1,18 @@
-from pydantic import BaseModel, EmailStr, constr, Field, computed_field
+from pydantic import BaseModel, EmailStr, constr, Field, computed_field, model_validator
+from typing import Literal
 from typing import Optional
 import uuid
 from datetime import datetime
+from app.config import settings
 
 class ReserveRequest(BaseModel):
     tester_name: str = Field(..., example="John Doe")
     country: str = Field(None, example="UK")
     code_type: str = Field(None, example="OSV")
+    wait_seconds: Optional[int] = Field(
+        None, ge=0, le=settings.RESERVE_WAIT_MAX_SECONDS, example=30,
+        description="If the pool is empty, wait up to this long for a code to be returned",
+    )
 
     class Config:
         from_attributes = True
@@ -16,6 +22,20 @@ class ReserveResponse(BaseModel):
     code: str
     code_type: str = Field(None, example="OSV")
     reservation_token: uuid.UUID
+    region: Optional[str] = Field(None, example="Europe")
+
+    class Config:
+        from_attributes = True
+
+class BatchReserveRequest(ReserveRequest):
+    count: int = Field(..., ge=1, le=200, example=20)
+
+
+class BatchReserveResponse(BaseModel):
+    requested: int
+    reserved: int
+    partial: bool = Field(..., description="True when fewer codes than requested were available")
+    codes: list[ReserveResponse]
 
     class Config:
         from_attributes = True
@@ -50,6 +70,35 @@ class BatchCodes(BaseModel):
         from_attributes = True
 
 
+class BatchReleaseRequest(BaseModel):
+    codes: Optional[list[str]] = Field(None, example=["A0AA-3BBB-1234-D7D4", "B1BB-4CCC-5678-E8E5"])
+    all: bool = Field(False, description="Release every code currently reserved by me")
+    clearance_id: Optional[str] = None
+    note: Optional[str] = None
+
+    @model_validator(mode="after")
+    def codes_or_all(self):
+        if self.all == bool(self.codes):
+            raise ValueError("Provide either a non-empty 'codes' list or 'all': true")
+        if self.codes:
+            self.codes = list(dict.fromkeys(c.strip() for c in self.codes))
+        return self
+
+    class Config:
+        from_attributes = True
+
+
+class ReleaseOutcome(BaseModel):
+    code: str
+    status: Literal["released", "not_reserved"]
+
+
+class BatchReleaseResponse(BaseModel):
+    released: int
+    results: list[ReleaseOutcome]
+    clearance_id: Optional[str] = None
+
+
 class MarkNonUsableRequest(BaseModel):
     codes: str
     reason: Optional[str] = None
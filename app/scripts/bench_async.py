@@ -0,0 +1,104 @@
+"""
+Request throughput of the threadpool model vs the native async model.
+
+Each simulated client loops over one request: --think-ms of non-database
+waiting (auth, serialization, downstream calls) followed by a reservation
+that is rolled back, so the pool never drains. In "threadpool" mode the
+request body is a sync function sent through run_in_threadpool, the way the
+handlers used to work; in "async" mode it is awaited on the event loop with
+an AsyncSession. Both use a connection pool of --pool-size.
+
+    python -m app.scripts.bench_async --levels 50 200 1000 --seconds 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.core.exceptions import NoCodesAvailableError
+from app.db.models import User
+from app.db.users import async_crud, crud
+
+
+async def run_level(request, clients, seconds):
+    latencies: list[float] = []
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    return len(latencies) / elapsed, statistics.median(latencies or [0]) * 1000, p99 * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--think-ms", type=float, default=20)
+    parser.add_argument("--pool-size", type=int, default=30)
+    parser.add_argument("--code-type", default="OSV")
+    parser.add_argument("--country", default=None)
+    args = parser.parse_args()
+    think = args.think_ms / 1000
+
+    engine = create_engine(settings.DATABASE_URL, pool_size=args.pool_size, max_overflow=0, pool_timeout=120)
+    Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async_engine = create_async_engine(
+        make_url(settings.DATABASE_URL).set(drivername="postgresql+psycopg"),
+        pool_size=args.pool_size, max_overflow=0, pool_timeout=120,
+    )
+    AsyncSession = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+    with Session() as db:
+        user = db.execute(select(User).where(User.is_admin.is_(False)).limit(1)).scalar_one()
+
+    def sync_request():
+        time.sleep(think)
+        with Session() as db:
+            try:
+                crud.reserve_one_code(db=db, user=user, tester_name="bench",
+                                      country=args.country, code_type=args.code_type)
+            except NoCodesAvailableError:
+                pass
+            db.rollback()
+
+    async def threadpool_request():
+        await run_in_threadpool(sync_request)
+
+    async def async_request():
+        await asyncio.sleep(think)
+        async with AsyncSession() as db:
+            try:
+                await async_crud.reserve_one_code(db=db, user=user, tester_name="bench",
+                                                  country=args.country, code_type=args.code_type)
+            except NoCodesAvailableError:
+                pass
+            await db.rollback()
+
+    print(f"{'clients':>8} {'model':>11} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for level in args.levels:
+        for name, request in (("threadpool", threadpool_request), ("async", async_request)):
+            rps, p50, p99 = await run_level(request, level, args.seconds)
+            print(f"{level:>8} {name:>11} {rps:>9.1f} {p50:>9.1f} {p99:>9.1f}")
+
+    engine.dispose()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
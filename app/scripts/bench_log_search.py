@@ -0,0 +1,108 @@
+"""
+Log search latency: the old LIKE '%x' / ILIKE '%x%' predicates vs the
+indexed ones built by app.db.admin.crud._log_filters.
+
+--seed N first appends N synthetic log rows (note 'bench_log_search'), which
+--cleanup removes again at the end. Each search is timed as the /admin/logs
+page query plus its exact count.
+
+    python -m app.scripts.bench_log_search --seed 5000000 --cleanup
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import create_engine, func, or_, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.db.admin.crud import _log_filters
+from app.db.ddl import ensure_indexes, ensure_log_search, log_search
+from app.db.models import Log
+
+NOTE = "bench_log_search"
+
+
+def legacy_filters(code=None, user_name=None) -> list:
+    filters = []
+    if code:
+        filters.append(or_(Log.code.like(f"{code}%"), Log.code.like(f"%{code}")))
+    if user_name:
+        filters.append(Log.user_name.ilike(f"%{user_name}%"))
+    return filters
+
+
+def seed(engine, rows: int, chunk: int = 500_000):
+    with engine.connect() as conn:
+        for start in range(0, rows, chunk):
+            conn.execute(text("""
+                INSERT INTO logs (code, user_name, action, note, logged_at)
+                SELECT upper(substr(h, 1, 4) || '-' || substr(h, 5, 4) || '-' || substr(h, 9, 4) || '-' || substr(h, 13, 4)),
+                       'tester' || (g % 5000), 'RESERVED', :note, now() - make_interval(secs => g)
+                FROM (SELECT g, md5(g::text) AS h FROM generate_series(:lo, :hi) g) s
+            """), {"note": NOTE, "lo": start + 1, "hi": min(start + chunk, rows)})
+            conn.commit()
+            print(f"  seeded {min(start + chunk, rows):,} rows")
+        conn.execute(text("ANALYZE logs"))
+        conn.commit()
+
+
+def time_search(Session, filters, repeat: int) -> tuple[float, str]:
+    page = select(Log).where(*filters).order_by(Log.logged_at.desc(), Log.id.desc()).limit(21)
+    count = select(func.count()).select_from(Log).where(*filters)
+    timings = []
+    with Session() as db:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            db.execute(page).all()
+            db.execute(count).scalar()
+            timings.append(time.perf_counter() - started)
+        compiled = count.compile(dialect=db.get_bind().dialect)
+        plan = "\n".join(db.connection().exec_driver_sql("EXPLAIN " + str(compiled), compiled.params).scalars())
+    scan = "seq scan" if "Seq Scan on logs" in plan else "index"
+    return statistics.median(timings) * 1000, scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="synthetic log rows to add first")
+    parser.add_argument("--cleanup", action="store_true", help="delete the seeded rows afterwards")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(settings.DATABASE_URL)
+    Session = sessionmaker(bind=engine)
+    if args.seed:
+        print(f"seeding {args.seed:,} rows")
+        seed(engine, args.seed)
+    ensure_indexes(engine)
+    ensure_log_search(engine)
+
+    with Session() as db:
+        total = db.execute(select(func.count()).select_from(Log)).scalar()
+        sample = db.execute(select(Log.code).where(Log.note == NOTE).limit(1)).scalar() or \
+            db.execute(select(Log.code).limit(1)).scalar()
+    print(f"logs: {total:,} rows, user_name search via "
+          f"{'log_user_names' if log_search.user_names_table else 'pg_trgm / ILIKE'}")
+
+    searches = [
+        ("code prefix", {"code": sample[:9]}),
+        ("code suffix", {"code": sample[-9:]}),
+        ("user_name", {"user_name": "ester4999"}),
+    ]
+    print(f"{'search':>12} {'legacy ms':>10} {'plan':>9} {'indexed ms':>11} {'plan':>9}")
+    for name, kw in searches:
+        old_ms, old_scan = time_search(Session, legacy_filters(**kw), args.repeat)
+        new_ms, new_scan = time_search(Session, _log_filters(None, None, kw.get("code"), kw.get("user_name"), None),
+                                       args.repeat)
+        print(f"{name:>12} {old_ms:>10.1f} {old_scan:>9} {new_ms:>11.1f} {new_scan:>9}")
+
+    if args.cleanup and args.seed:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM logs WHERE note = :note"), {"note": NOTE})
+        print("seeded rows removed")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
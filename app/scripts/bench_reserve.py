@@ -0,0 +1,88 @@
+"""
+Reserve throughput vs concurrency for the candidate selection strategies.
+
+Every worker reserves one code, holds the row lock for --hold-ms (simulating
+the rest of the request) and rolls back, so the pool never drains and all
+workers keep competing for the same head rows.
+
+    python -m app.scripts.bench_reserve --levels 1 8 16 32 64 --seconds 10
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.core.exceptions import NoCodesAvailableError
+from app.db.models import User
+from app.db.users import crud
+
+
+def run_level(Session, user, selection, concurrency, seconds, hold, code_type, country):
+    reserved = 0
+    empty = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        nonlocal reserved, empty
+        ok = miss = 0
+        while time.perf_counter() < deadline:
+            db = Session()
+            try:
+                crud.reserve_one_code(db=db, user=user, tester_name="bench", country=country,
+                                      code_type=code_type, selection=selection)
+                ok += 1
+                if hold:
+                    time.sleep(hold)
+            except NoCodesAvailableError:
+                miss += 1
+            finally:
+                db.rollback()
+                db.close()
+        with lock:
+            reserved += ok
+            empty += miss
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return reserved / elapsed, empty
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 16, 32, 64])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--hold-ms", type=float, default=5)
+    parser.add_argument("--code-type", default="OSV")
+    parser.add_argument("--country", default=None)
+    parser.add_argument("--strategies", nargs="+", default=["head", "window"])
+    args = parser.parse_args()
+
+    engine = create_engine(settings.DATABASE_URL, pool_size=max(args.levels), max_overflow=0)
+    Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    with Session() as db:
+        user = db.execute(select(User).where(User.is_admin.is_(False)).limit(1)).scalar_one()
+
+    print(f"{'clients':>8} " + " ".join(f"{s + ' rps':>14}" for s in args.strategies) + f" {'empty':>8}")
+    for level in args.levels:
+        results = [
+            run_level(Session, user, s, level, args.seconds, args.hold_ms / 1000, args.code_type, args.country)
+            for s in args.strategies
+        ]
+        print(f"{level:>8} " + " ".join(f"{rps:>14.1f}" for rps, _ in results)
+              + f" {sum(e for _, e in results):>8}")
+
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,12 @@
-from app.db.engine import SessionLocal
-from app.db.users import crud
+from app.core.maintenance import expire_reservations
 
 
 def main():
-    db = SessionLocal()
-    try:
-        expired = crud.expire_stale_reservations(db)
-        if expired:
-            print("Expired codes:", expired)
-    finally:
-        db.close()
+    expired = expire_reservations()
+    if expired is None:
+        print("Another node is sweeping, nothing done")
+    else:
+        print("Expired codes:", expired)
 
 if __name__ == "__main__":
     main()